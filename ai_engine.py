@@ -1,58 +1,50 @@
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import json
-from PIL import Image
+import threading
+from functools import lru_cache
+from image_pipeline import ImagePipeline
+from pdf_ingest import prepare_sheet
+from json_stream import IncrementalJSONParser, extract_json
+from model_catalog import get_model_catalog
+from model_backends import GeminiBackend
+from metrics import get_metrics, payload_bytes, usage_counts
 
 load_dotenv()
 
-class AIGrader:
-    def __init__(self, api_key, model_name):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name)
+def strictness_instructions(strictness):
+    if strictness == "Strict":
+        return "Be very strict. Deduct marks for minor errors, spelling mistakes, and lack of clarity. Expect high precision."
+    elif strictness == "Lenient":
+        return "Be lenient. Award marks for partial understanding and effort. Ignore minor spelling or grammatical errors if the concept is understood."
+    return "Be moderate. Balance precision with understanding. Grade fairly based on the rubric."
 
-    @staticmethod
-    def list_available_models(api_key):
-        """
-        Lists available Gemini models that support content generation.
-        """
-        try:
-            genai.configure(api_key=api_key)
-            models = []
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    models.append(m.name)
-            models.sort(reverse=True) 
-            return models
-        except Exception as e:
-            return []
 
-    def grade_submission(self, image_path, question_paper, answer_key, max_marks, student_name, student_level="High School", strictness="Moderate", language="English"):
-        """
-        Grades the answer sheet image against the provided context with strictness control and language support.
-        """
-        
-        img = Image.open(image_path)
+def language_instructions(language):
+    if language == "Tamil":
+        return "Provide the 'overall_feedback', 'improvement_pointers', and 'real_world_connections' in Tamil language. Keep technical terms in English if needed for clarity, but the explanation should be in Tamil."
+    return "Provide all feedback and explanations in English."
 
-        strictness_prompt = ""
-        if strictness == "Strict":
-            strictness_prompt = "Be very strict. Deduct marks for minor errors, spelling mistakes, and lack of clarity. Expect high precision."
-        elif strictness == "Lenient":
-            strictness_prompt = "Be lenient. Award marks for partial understanding and effort. Ignore minor spelling or grammatical errors if the concept is understood."
-        else:
-            strictness_prompt = "Be moderate. Balance precision with understanding. Grade fairly based on the rubric."
 
-        lang_prompt = ""
-        if language == "Tamil":
-            lang_prompt = "Provide the 'overall_feedback', 'improvement_pointers', and 'real_world_connections' in Tamil language. Keep technical terms in English if needed for clarity, but the explanation should be in Tamil."
-        else:
-            lang_prompt = "Provide all feedback and explanations in English."
+class GradingPrompt:
+    """
+    Grading prompt for one exam, rendered once per (exam context, strictness, language).
+    Only the student name is filled in per sheet.
+    """
+    STUDENT_NAME_SLOT = "\x00STUDENT_NAME\x00"
+
+    def __init__(self, question_paper, answer_key, max_marks, student_level="High School", strictness="Moderate", language="English"):
+        STUDENT_NAME_SLOT = self.STUDENT_NAME_SLOT
+
+        strictness_prompt = strictness_instructions(strictness)
+        lang_prompt = language_instructions(language)
+        name_line = f"**Student Name:** {STUDENT_NAME_SLOT} (Use this name in the report)"
 
         prompt = f"""
         You are an expert academic grader for {student_level} students in Tamil Nadu, India. 
-        Your task is to grade the handwritten answer sheet provided in the image.
+        Your task is to grade the handwritten answer sheet provided in the image(s). Multi-page sheets are given in page order.
         
-        **Student Name:** {student_name} (Use this name in the report)
+        {name_line}
         **Grading Mode:** {strictness}
         {strictness_prompt}
         
@@ -74,7 +66,7 @@ class AIGrader:
         
         **JSON Structure:**
         {{
-            "student_name": "{student_name}",
+            "student_name": "{STUDENT_NAME_SLOT}",
             "total_score_obtained": float,
             "max_score": {max_marks},
             "question_wise_breakdown": [
@@ -99,34 +91,358 @@ class AIGrader:
         }}
         """
 
+        self.parts = prompt.split(STUDENT_NAME_SLOT)
+        # Student-independent version for provider-side context caching: no name line and a neutral
+        # schema hint, so the name given in student_text() is the only one the model sees.
+        self.context_text = prompt.replace(name_line + "\n        ", "").replace(STUDENT_NAME_SLOT, "<name given with the sheet>")
+
+    def render(self, student_name):
+        return student_name.join(self.parts)
+
+    @staticmethod
+    def student_text(student_name):
+        return f"**Student Name:** {student_name} (Use this name in the report and in the \"student_name\" field.) Grade the answer sheet in the following image(s)."
+
+
+@lru_cache(maxsize=32)
+def get_grading_prompt(question_paper, answer_key, max_marks, student_level="High School", strictness="Moderate", language="English"):
+    """
+    Returns the shared GradingPrompt for an exam context, building it on first use.
+    """
+    return GradingPrompt(question_paper, answer_key, max_marks, student_level, strictness, language)
+
+
+class PackedGradingPrompt:
+    """
+    Grading prompt that sends the exam context once for several students' sheets.
+    The model returns a JSON array with one result per sheet, tagged with the sheet's student_id.
+    """
+    def __init__(self, question_paper, answer_key, max_marks, student_level="High School", strictness="Moderate", language="English"):
+        self.prompt = f"""
+        You are an expert academic grader for {student_level} students in Tamil Nadu, India. 
+        Your task is to grade several different students' handwritten answer sheets in one pass.
+        Each sheet starts with a line "=== SHEET <n>: student_id=<id>, student_name=<name> ===" followed by that sheet's page image(s) in page order.
+        Grade every sheet independently. Never mix answers between sheets.
+        
+        **Grading Mode:** {strictness}
+        {strictness_instructions(strictness)}
+        
+        **Language Requirement:**
+        {language_instructions(language)}
+        
+        **Context:**
+        - Question Paper: {question_paper}
+        - Answer Key / Rubric: {answer_key}
+        - Maximum Marks: {max_marks}
+        
+        **Instructions:**
+        1. **Analyze the Images**: Read each sheet's handwritten answers carefully. Handle messy handwriting gracefully.
+        2. **Grade**: Assign marks for each question based on the Answer Key and the Grading Mode.
+        3. **Feedback**: Provide specific feedback for each answer. Point out what was correct and what was missing.
+        4. **Improvement**: Suggest how the student can improve for next time.
+        5. **Real World Context**: For every major concept, explain its importance in real life.
+        6. **Output Format**: Return strictly a JSON array with exactly one object per sheet, in sheet order.
+        
+        **JSON Structure (one element per sheet):**
+        [
+            {{
+                "student_id": "<student_id from the sheet header>",
+                "student_name": "<student_name from the sheet header>",
+                "total_score_obtained": float,
+                "max_score": {max_marks},
+                "question_wise_breakdown": [
+                    {{
+                        "question_number": "1",
+                        "marks_obtained": float,
+                        "max_marks": float,
+                        "feedback": "Specific feedback for this answer",
+                        "status": "Correct/Partially Correct/Incorrect"
+                    }}
+                ],
+                "overall_feedback": "General summary of performance",
+                "improvement_pointers": ["Point 1", "Point 2"],
+                "concepts_to_revise": ["Concept 1", "Concept 2"],
+                "real_world_connections": "A short paragraph explaining the real-world importance of the topics covered in this exam."
+            }}
+        ]
+        """
+
+    @staticmethod
+    def sheet_header(index, student_id, student_name):
+        return f"=== SHEET {index}: student_id={student_id}, student_name={student_name} ==="
+
+
+@lru_cache(maxsize=32)
+def get_packed_grading_prompt(question_paper, answer_key, max_marks, student_level="High School", strictness="Moderate", language="English"):
+    return PackedGradingPrompt(question_paper, answer_key, max_marks, student_level, strictness, language)
+
+
+def match_packed_results(results, sheets):
+    """
+    Maps a packed reply back to its sheets. Returns {student_id: result} only if the reply has
+    exactly one well-formed result per sheet, otherwise None.
+    """
+    if isinstance(results, dict):
+        results = results.get("results")
+    if not isinstance(results, list) or len(results) != len(sheets):
+        return None
+    expected = {str(sheet["student_id"]): sheet["student_id"] for sheet in sheets}
+    matched = {}
+    for result in results:
+        if not isinstance(result, dict) or "total_score_obtained" not in result:
+            return None
+        key = str(result.pop("student_id", "")).strip()
+        if key not in expected or expected[key] in matched:
+            return None
+        matched[expected[key]] = result
+    return matched
+
+
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+
+def chunk_text(chunk):
+    # Chunks without text parts (e.g. safety-only or usage-only chunks) raise on .text
+    try:
+        return chunk.text
+    except (ValueError, AttributeError):
+        return ""
+
+
+class AIGrader:
+    """
+    Grades answer sheets through a model backend: Gemini by default, or any object with
+    `generate_content(contents, generation_config=None, stream=False)` such as
+    `model_backends.FakeBackend` for offline runs and benchmarks.
+    """
+    def __init__(self, api_key, model_name, cache=None, pipeline=None, context_cache=None, backend=None, metrics=None, derivatives=None):
+        self.model_name = model_name
+        self.model = backend or GeminiBackend(api_key, model_name)
+        self.metrics = metrics or get_metrics()
+        self.cache = cache
+        self.pipeline = pipeline or ImagePipeline()
+        self.derivatives = derivatives
+        self.context_cache = context_cache
+        # Structured JSON output; switched off for models that reject response_mime_type.
+        self.json_mode = True
+
+    @staticmethod
+    def fetch_models(api_key):
+        """
+        Lists available Gemini models that support content generation straight from the API.
+        Raises on network or auth errors.
+        """
+        return GeminiBackend.list_models(api_key)
+
+    @staticmethod
+    def list_available_models(api_key):
+        """
+        Lists available Gemini models that support content generation.
+        Served from the process-wide model catalog, so reruns don't wait on the network.
+        """
+        try:
+            return get_model_catalog().get_models(api_key)
+        except Exception as e:
+            return []
+
+    def _generate_json(self, contents, stream=False, model=None):
+        model = model or self.model
+        if self.json_mode:
+            try:
+                return model.generate_content(contents, generation_config=JSON_GENERATION_CONFIG, stream=stream)
+            except Exception as e:
+                if "mime" not in str(e).lower():
+                    raise
+                self.json_mode = False
+        return model.generate_content(contents, stream=stream)
+
+    def _record_request(self, contents, response):
+        self.metrics.observe("payload_bytes", payload_bytes(contents))
+        prompt_tokens, output_tokens, total_tokens = usage_counts(response)
+        self.metrics.observe("prompt_tokens", prompt_tokens)
+        self.metrics.observe("output_tokens", output_tokens)
+        self.metrics.observe("total_tokens", total_tokens)
+
+    def _prepare_pages(self, image_path, image_bytes):
+        # Sheets saved with model-ready derivatives for this pipeline skip decoding entirely.
+        if self.derivatives is not None:
+            pages = self.derivatives.model_pages(image_path, self.pipeline)
+            if pages is not None:
+                self.metrics.increment("derivative_hits")
+                return pages
+        return prepare_sheet(image_path, image_bytes, self.pipeline)
+
+    def _cached_model(self, context):
+        """
+        Returns a model bound to the cached copy of `context`, or None if context caching is off or unavailable.
+        """
+        if self.context_cache is None:
+            return None
+        handle = self.context_cache.get(self.model_name, context)
+        if handle is None:
+            return None
+        return self.context_cache.bind(handle, self.model)
+
+    def grade_submission(self, image_path, question_paper, answer_key, max_marks, student_name, student_level="High School", strictness="Moderate", language="English", on_partial=None, image_bytes=None):
+        """
+        Grades the answer sheet image (or multi-page PDF) against the provided context with strictness control and language support.
+        All pages are sent in a single call. The sheet is shrunk by `self.pipeline` before upload, or taken from `self.derivatives` when it was prepared at save time. Results are served from `self.cache`
+        when the same sheet was already graded with the same context.
+        If `on_partial` is given, the reply is streamed and `on_partial(partial_result)` is called as fields arrive.
+        With `self.context_cache` set, the exam context is referenced through a cached-context handle instead of being resent.
+        Stage timings, payload size and token usage are recorded in `self.metrics`.
+        Pass `image_bytes` (e.g. the upload's buffer) to skip reading the sheet back from `image_path`.
+        """
+        metrics = self.metrics
+        if image_bytes is None:
+            with metrics.span("sheet_read"):
+                with open(image_path, "rb") as f:
+                    image_bytes = f.read()
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(image_bytes, question_paper, answer_key, max_marks, strictness, language, student_level, self.model_name, student_name)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.increment("grade_cache_hits")
+                return cached
+
+        with metrics.span("image_prep"):
+            pages = [page.as_part() for page in self._prepare_pages(image_path, image_bytes)]
+
+        grading_prompt = get_grading_prompt(question_paper, answer_key, max_marks, student_level, strictness, language)
+
         try:
-            response = self.model.generate_content([prompt, img])
-            text_response = response.text.strip()
-            if text_response.startswith("```json"):
-                text_response = text_response[7:-3]
-            elif text_response.startswith("```"):
-                text_response = text_response[3:-3]
-            return json.loads(text_response)
+            # With a cached exam context only the student's name and pages are sent per sheet.
+            model = self._cached_model(grading_prompt.context_text)
+            if model is not None:
+                contents = [grading_prompt.student_text(student_name)] + pages
+            else:
+                contents = [grading_prompt.render(student_name)] + pages
+
+            # When streaming, the span covers the whole stream (including partial parses), not just the first byte.
+            with metrics.span("model_call"):
+                if on_partial is None:
+                    response = self._generate_json(contents, model=model)
+                    text_response = response.text
+                else:
+                    parser = IncrementalJSONParser()
+                    response = self._generate_json(contents, stream=True, model=model)
+                    for chunk in response:
+                        partial = parser.feed(chunk_text(chunk))
+                        if isinstance(partial, dict):
+                            on_partial(partial)
+                    text_response = parser.text
+            self._record_request(contents, response)
+            with metrics.span("json_parse"):
+                result = extract_json(text_response)
+            if not isinstance(result, dict) or "total_score_obtained" not in result:
+                raise ValueError("Model response is missing total_score_obtained")
+            if cache_key is not None:
+                self.cache.put(cache_key, result)
+            return result
         except Exception as e:
+            metrics.increment("grading_errors")
             return {"error": str(e)}
 
-    def generate_study_plan(self, grading_result, language="English"):
+    def grade_submissions_packed(self, sheets, question_paper, answer_key, max_marks, student_level="High School", strictness="Moderate", language="English"):
+        """
+        Grades several students' sheets in one model call, sending the exam context only once.
+
+        `sheets` are dicts with `student_id`, `student_name` and `image_path`. Returns
+        {student_id: result} in the single-sheet schema, or None if the reply could not be mapped
+        back to every sheet (callers should then fall back to `grade_submission`). Sheets already
+        in `self.cache` are not re-sent.
+        """
+        metrics = self.metrics
+        results = {}
+        cache_keys = {}
+        contents = []
+        pending = []
+        for sheet in sheets:
+            with metrics.span("sheet_read"):
+                with open(sheet["image_path"], "rb") as f:
+                    image_bytes = f.read()
+            if self.cache is not None:
+                cache_key = self.cache.make_key(image_bytes, question_paper, answer_key, max_marks, strictness, language, student_level, self.model_name, sheet["student_name"])
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    metrics.increment("grade_cache_hits")
+                    results[sheet["student_id"]] = cached
+                    continue
+                cache_keys[sheet["student_id"]] = cache_key
+            pending.append(sheet)
+            contents.append(PackedGradingPrompt.sheet_header(len(pending), sheet["student_id"], sheet["student_name"]))
+            with metrics.span("image_prep"):
+                contents.extend(page.as_part() for page in self._prepare_pages(sheet["image_path"], image_bytes))
+
+        if not pending:
+            return results
+
+        prompt = get_packed_grading_prompt(question_paper, answer_key, max_marks, student_level, strictness, language).prompt
+        try:
+            model = self._cached_model(prompt)
+            if model is None:
+                contents = [prompt] + contents
+            with metrics.span("model_call"):
+                response = self._generate_json(contents, model=model)
+                text_response = response.text
+            self._record_request(contents, response)
+            with metrics.span("json_parse"):
+                matched = match_packed_results(extract_json(text_response), pending)
+        except Exception as e:
+            metrics.increment("packed_fallbacks")
+            return None
+        if matched is None:
+            metrics.increment("packed_fallbacks")
+            return None
+        for student_id, result in matched.items():
+            if student_id in cache_keys:
+                self.cache.put(cache_keys[student_id], result)
+        results.update(matched)
+        return results
+
+    def generate_study_plan(self, concepts, language="English"):
         """
-        Generates a personalized study plan based on the grading result.
+        Generates a study plan (Markdown) for a set of concepts to revise.
+        The plan depends only on the concepts and language, so students with the same weak areas can share it.
+        Raises on model errors.
         """
         lang_prompt = "in Tamil" if language == "Tamil" else "in English"
         
         prompt = f"""
-        Based on the following grading result, create a short, motivating study plan for the student {lang_prompt}.
-        Focus on the 'concepts_to_revise'. Explain *why* these concepts are important in real life (connect to real world applications).
+        Create a short, motivating study plan for a student {lang_prompt} who needs to revise the concepts below.
+        Explain *why* these concepts are important in real life (connect to real world applications).
         
-        Grading Result:
-        {json.dumps(grading_result)}
+        Concepts to Revise:
+        {json.dumps(list(concepts))}
         
         Output Format: Markdown
         """
-        try:
+        with self.metrics.span("study_plan_call"):
             response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            return "Could not generate study plan."
+        self._record_request([prompt], response)
+        return response.text
+
+
+_graders = {}
+_graders_lock = threading.Lock()
+
+
+def get_grader(api_key, model_name, cache=None, context_cache=None, derivatives=None):
+    """
+    Returns the process-wide AIGrader for (api_key, model_name), creating it on first use.
+    """
+    key = (api_key, model_name)
+    with _graders_lock:
+        grader = _graders.get(key)
+        if grader is None:
+            grader = AIGrader(api_key, model_name, cache=cache, context_cache=context_cache, derivatives=derivatives)
+            _graders[key] = grader
+        else:
+            if cache is not None:
+                grader.cache = cache
+            if derivatives is not None:
+                grader.derivatives = derivatives
+            grader.context_cache = context_cache
+    return grader
@@ -0,0 +1,183 @@
+import json
+import threading
+from collections import Counter
+
+import numpy as np
+
+from concepts import normalise_concept
+
+PERCENTILES = (10, 25, 50, 75, 90)
+DISCRIMINATION_GROUP = 0.27  # Kelley's upper/lower 27% groups
+
+
+def question_sort_key(question_number):
+    try:
+        return (0, float(question_number), question_number)
+    except ValueError:
+        return (1, 0.0, question_number)
+
+
+class _ExamState:
+    """
+    Per-student rows for one exam, as last loaded from the database.
+    """
+    def __init__(self):
+        self.versions = {}   # student_id -> updated_at
+        self.totals = {}     # student_id -> total_score_obtained
+        self.max_score = None
+        self.questions = {}  # student_id -> {question_number: (marks_obtained, max_marks)}
+        self.concepts = {}   # student_id -> [concept, ...]
+        self.stats = None
+
+
+class ExamAnalytics:
+    """
+    Score statistics for an exam, computed with NumPy and cached per exam.
+
+    `get_stats` compares each submission's `updated_at` with the cached copy and reloads only the
+    submissions that changed. Statistics are recomputed only when something did.
+    """
+    def __init__(self, db, histogram_bins=10, top_concepts=10):
+        self.db = db
+        self.histogram_bins = histogram_bins
+        self.top_concepts = top_concepts
+        self.lock = threading.Lock()
+        self.exams = {}
+
+    def invalidate(self, exam_id=None):
+        with self.lock:
+            if exam_id is None:
+                self.exams.clear()
+            else:
+                self.exams.pop(exam_id, None)
+
+    def get_stats(self, exam_id):
+        with self.lock:
+            state = self.exams.setdefault(exam_id, _ExamState())
+            if self._refresh(exam_id, state) or state.stats is None:
+                state.stats = self._compute(state)
+            return state.stats
+
+    def _refresh(self, exam_id, state):
+        versions = self.db.get_submission_versions(exam_id)
+        removed = [sid for sid in state.versions if sid not in versions]
+        changed = [sid for sid, ts in versions.items() if state.versions.get(sid) != ts]
+        if not removed and not changed:
+            return False
+
+        for sid in removed:
+            state.totals.pop(sid, None)
+            state.questions.pop(sid, None)
+            state.concepts.pop(sid, None)
+            state.versions.pop(sid, None)
+
+        # On first load, fetch the whole exam instead of a huge IN list.
+        student_ids = None if not state.versions else changed
+        for sid in changed:
+            state.questions[sid] = {}
+        for student_id, total, max_score, grades_json, updated_at in self.db.get_exam_results(exam_id, student_ids):
+            state.versions[student_id] = updated_at
+            if total is None:
+                state.totals.pop(student_id, None)
+            else:
+                state.totals[student_id] = total
+            if max_score is not None:
+                state.max_score = max_score
+            state.concepts[student_id] = self._concepts(grades_json)
+        for student_id, question_number, marks, max_marks in self.db.get_exam_question_marks(exam_id, student_ids):
+            state.questions.setdefault(student_id, {})[question_number] = (marks, max_marks)
+        return True
+
+    @staticmethod
+    def _concepts(grades_json):
+        if not grades_json:
+            return []
+        try:
+            grades = json.loads(grades_json)
+        except ValueError:
+            return []
+        if not isinstance(grades, dict):
+            return []
+        return [c for c in (normalise_concept(c) for c in grades.get("concepts_to_revise") or []) if c]
+
+    def _compute(self, state):
+        student_ids = sorted(state.totals)
+        scores = np.array([state.totals[sid] for sid in student_ids], dtype=float)
+        stats = {
+            "count": int(scores.size),
+            "max_score": state.max_score,
+            "mean": None,
+            "median": None,
+            "std": None,
+            "percentiles": {},
+            "histogram": {"counts": [], "edges": []},
+            "questions": [],
+            "top_concepts": [],
+        }
+
+        concept_counts = Counter()
+        for concepts in state.concepts.values():
+            concept_counts.update(set(concepts))
+        stats["top_concepts"] = concept_counts.most_common(self.top_concepts)
+
+        if scores.size == 0:
+            return stats
+
+        stats["mean"] = float(scores.mean())
+        stats["median"] = float(np.median(scores))
+        stats["std"] = float(scores.std())
+        stats["percentiles"] = dict(zip(PERCENTILES, (float(v) for v in np.percentile(scores, PERCENTILES))))
+        upper = state.max_score if state.max_score else float(scores.max()) or 1.0
+        counts, edges = np.histogram(np.clip(scores, 0, upper), bins=self.histogram_bins, range=(0, upper))
+        stats["histogram"] = {"counts": counts.tolist(), "edges": edges.tolist()}
+        stats["questions"] = self._question_stats(state, student_ids, scores)
+        return stats
+
+    @staticmethod
+    def _question_stats(state, student_ids, scores):
+        question_numbers = sorted({q for sid in student_ids for q in state.questions.get(sid, {})}, key=question_sort_key)
+        if not question_numbers:
+            return []
+
+        # students x questions, NaN where a student has no mark for a question
+        marks = np.full((len(student_ids), len(question_numbers)), np.nan)
+        max_marks = np.full(len(question_numbers), np.nan)
+        column = {q: j for j, q in enumerate(question_numbers)}
+        for i, sid in enumerate(student_ids):
+            for q, (obtained, q_max) in state.questions.get(sid, {}).items():
+                j = column[q]
+                if obtained is not None:
+                    marks[i, j] = obtained
+                if q_max is not None and (np.isnan(max_marks[j]) or q_max > max_marks[j]):
+                    max_marks[j] = q_max
+
+        order = np.argsort(scores, kind="stable")
+        group = max(1, int(round(len(student_ids) * DISCRIMINATION_GROUP)))
+        lower, upper = marks[order[:group]], marks[order[-group:]]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            attempts = np.sum(~np.isnan(marks), axis=0)
+            mean_marks = _nanmean(marks)
+            difficulty = mean_marks / max_marks
+            discrimination = (_nanmean(upper) - _nanmean(lower)) / max_marks
+
+        rows = []
+        for j, q in enumerate(question_numbers):
+            rows.append({
+                "question_number": q,
+                "attempts": int(attempts[j]),
+                "mean_marks": _as_float(mean_marks[j]),
+                "max_marks": _as_float(max_marks[j]),
+                "difficulty": _as_float(difficulty[j]),
+                "discrimination": _as_float(discrimination[j]),
+            })
+        return rows
+
+
+def _nanmean(values):
+    counts = np.sum(~np.isnan(values), axis=0)
+    return np.nansum(values, axis=0) / np.where(counts > 0, counts, np.nan)
+
+
+def _as_float(value):
+    return None if np.isnan(value) else round(float(value), 3)
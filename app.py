@@ -2,17 +2,92 @@ import streamlit as st
 import os
 from ai_engine import AIGrader
 from database import DatabaseManager
-from utils import save_uploaded_file, cleanup_temp_files
+from utils import save_uploaded_file, cleanup_temp_files, parse_roster_csv
+from grading_engine import BatchGrader
+from grade_cache import GradeCache
+from analytics import ExamAnalytics
+from context_cache import ExamContextCache
+from metrics import get_metrics
+from study_plans import StudyPlanGenerator
+from blob_store import BlobStore
+from sheet_derivatives import SheetDerivatives
 import json
 
 # Page Config
 st.set_page_config(page_title="AI Answer Grader", layout="wide", page_icon="🎓")
 
-# Initialize DB
-if 'db' not in st.session_state:
-    st.session_state.db = DatabaseManager()
+# Shared resources: created once per server process and reused by every browser session
+@st.cache_resource
+def get_database():
+    return DatabaseManager()
 
-db = st.session_state.db
+@st.cache_resource
+def get_grade_cache():
+    return GradeCache()
+
+@st.cache_resource
+def get_analytics():
+    # Cached per exam, refreshed when submissions change
+    return ExamAnalytics(get_database())
+
+@st.cache_resource
+def get_exam_context_cache():
+    # Cached exam contexts expire server-side after the TTL
+    return ExamContextCache(ttl_seconds=3600)
+
+@st.cache_resource
+def get_blob_store():
+    # Uploaded answer sheets, stored once per distinct content
+    return BlobStore()
+
+@st.cache_resource
+def get_sheet_derivatives():
+    # Thumbnail, preview and model-ready images, made once per distinct sheet
+    return SheetDerivatives(get_blob_store())
+
+@st.cache_resource
+def get_study_plan_generator():
+    # Study plans are generated off the request path, a few at a time
+    return StudyPlanGenerator(get_database(), max_workers=4)
+
+@st.cache_resource(show_spinner=False)
+def get_ai_grader(api_key, model_name, use_context_cache):
+    # The model SDK is only imported here, on the first grading call
+    return AIGrader(api_key, model_name, cache=get_grade_cache(), context_cache=get_exam_context_cache() if use_context_cache else None, derivatives=get_sheet_derivatives())
+
+db = get_database()
+grade_cache = get_grade_cache()
+analytics = get_analytics()
+metrics = get_metrics()
+
+# Answer sheets are saved as soon as they are uploaded, so they survive paging through the roster
+if 'pending_uploads' not in st.session_state:
+    st.session_state.pending_uploads = {}  # exam_id -> {student_id: {"name", "path"}}
+
+def stash_upload(exam_id, student_id, student_name):
+    uploads = st.session_state.pending_uploads.setdefault(exam_id, {})
+    uploaded_file = st.session_state.get(f"u_{exam_id}_{student_id}")
+    if uploaded_file is None:
+        uploads.pop(student_id, None)
+        return
+    with metrics.span("temp_save"):
+        fpath = save_uploaded_file(uploaded_file, store=get_blob_store())
+    if fpath:
+        # Decode the sheet once, now, for every later view and grading call
+        try:
+            with metrics.span("derivatives"):
+                get_sheet_derivatives().generate(fpath, uploaded_file.getbuffer())
+        except Exception:
+            pass  # Grading falls back to preparing the original
+        uploads[student_id] = {"name": student_name, "path": fpath}
+
+@st.cache_data(max_entries=2000, show_spinner=False)
+def load_report_card(submission_id, updated_at):
+    # Keyed on the submission's last update, so regrading or publishing is picked up on the next rerun
+    grades_json = db.get_submission_grades(submission_id)
+    return json.loads(grades_json) if grades_json else None
+
+JOB_STATUS_LABELS = {"queued": "Queued", "running": "Grading", "failed": "Failed", "done": "Graded"}
 
 # --- VIBRANT UI CSS ---
 st.markdown("""
@@ -129,6 +204,19 @@ with st.sidebar:
     
     # Language Settings
     language = st.radio("Feedback Language", ["English", "Tamil"])
+
+    # Batch Grading Limits
+    with st.expander("Batch Grading Settings"):
+        grading_mode = st.radio("Run Batches In", ["This Session", "Background Worker"], help="Background Worker queues sheets for `python -m worker` and only polls their status here.")
+        max_workers = st.number_input("Parallel Requests", min_value=1, max_value=32, value=8)
+        requests_per_minute = st.number_input("Requests per Minute", min_value=1, max_value=1000, value=60)
+        use_context_cache = st.checkbox("Cache Exam Context", value=False, help="Upload the question paper and answer key to the model once per exam and reference them from every sheet. Falls back to sending them inline if the model or context can't be cached.")
+        pack_size = st.number_input("Sheets per Request", min_value=1, max_value=8, value=1, help="Grade several students per model call, sending the question paper and answer key once. Falls back to one sheet per call if the reply doesn't match every student.")
+        cache_stats = grade_cache.stats()
+        st.caption(f"Result cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses · {cache_stats['entries']} sheets")
+        if st.button("🧹 Remove Unused Answer Sheets", help="Deletes stored sheets that no submission or queued job refers to (kept for a day after upload)."):
+            removed, freed = get_blob_store().collect_garbage(db.get_blob_refcounts())
+            st.caption(f"Removed {removed} sheets, freed {freed / 2 ** 20:.1f} MB.")
     
     st.divider()
     # Role Selection
@@ -138,7 +226,7 @@ with st.sidebar:
 if role == "Teacher":
     st.markdown('<h1 class="main-header">👨‍🏫 Teacher Dashboard</h1>', unsafe_allow_html=True)
     
-    tab1, tab2, tab3 = st.tabs(["Manage Classes", "Create Exam", "Grading & Results"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Manage Classes", "Create Exam", "Grading & Results", "Analytics"])
     
     # 1. Manage Classes
     with tab1:
@@ -166,6 +254,14 @@ if role == "Teacher":
                     if st.form_submit_button("Add Student"):
                         db.add_student(s_name, s_roll, selected_class_id)
                         st.success(f"Student {s_name} added!")
+                
+                with st.form("import_roster"):
+                    roster_file = st.file_uploader("Import Roster CSV (name, roll_number)", type=['csv'])
+                    if st.form_submit_button("Import Students") and roster_file:
+                        roster = parse_roster_csv(roster_file.getvalue())
+                        with db.transaction():
+                            imported = db.add_students([(name, roll, selected_class_id) for name, roll in roster])
+                        st.success(f"Imported {imported} students into {selected_class_name}!")
             else:
                 st.info("No classes found. Create one first.")
 
@@ -202,8 +298,14 @@ if role == "Teacher":
                 selected_exam = exam_opts[sel_exam_name] # (id, name, subj, cid, qp, key, max)
                 exam_id = selected_exam[0]
                 
-                # List Students
-                students = db.get_students_by_class(cid_grad)
+                # Cached exam contexts are released once grading moves on to another exam or model.
+                # The cache is shared by all sessions, so only handles nobody used lately are dropped.
+                context_selection = (selected_model, exam_id)
+                if st.session_state.get("context_selection", context_selection) != context_selection:
+                    get_exam_context_cache().release_idle(idle_seconds=120)
+                st.session_state.context_selection = context_selection
+                
+                exam_uploads = st.session_state.pending_uploads.setdefault(exam_id, {})
                 
                 st.divider()
                 
@@ -214,100 +316,192 @@ if role == "Teacher":
                 with c2:
                     strictness = st.select_slider("Grading Strictness", options=["Lenient", "Moderate", "Strict"], value="Moderate")
 
+                def run_grading_batch(tasks=None):
+                    # Works through this exam's grading queue; `tasks` are queued first if given.
+                    progress_bar = st.progress(0)
+                    progress_log = st.empty()
+                    
+                    def report_progress(done, total, task, res):
+                        progress_bar.progress(min(done / total, 1.0))
+                        if task["status"] == "done":
+                            outcome = "✅ Graded"
+                        elif task["status"] == "retrying":
+                            outcome = f"🔁 Retrying ({task['error_kind']}): {res['error']}"
+                        else:
+                            outcome = "❌ " + res["error"]
+                        progress_log.caption(f"{done}/{total} · {task['student_name']}: {outcome}")
+                    
+                    batch = BatchGrader(get_ai_grader(api_key, selected_model, use_context_cache), db, max_workers=max_workers, requests_per_minute=requests_per_minute, lease_seconds=120, pack_size=pack_size)
+                    if tasks is None:
+                        return batch.resume(exam_id, on_progress=report_progress)
+                    return batch.run(selected_exam, tasks, strictness=strictness, language=language, on_progress=report_progress)
+                
+                def show_batch_summary(summary):
+                    if summary["graded"] > 0:
+                        st.success(f"Successfully batch graded {summary['graded']} students!")
+                        st.rerun()
+                    elif summary["failed"] > 0:
+                        st.error(f"All {summary['failed']} gradings failed.")
+                    else:
+                        st.info("No pending uploads found to grade.")
+
                 # --- BATCH GRADING BUTTON ---
                 if st.button("⚡ Grade All Pending Answer Sheets"):
                     if selected_model:
-                        progress_bar = st.progress(0)
-                        graded_count = 0
-                        
-                        # We need to access uploaded files. 
-                        # Streamlit file_uploader widgets inside loops are accessible via session_state if keyed.
-                        for idx, stu in enumerate(students):
-                            stu_id = stu[0]
-                            stu_name = stu[1]
-                            
-                            # Check if file is uploaded in session state
-                            file_key = f"u_{stu_id}"
-                            if file_key in st.session_state and st.session_state[file_key] is not None:
-                                # Check if already graded
-                                sub = db.get_submission(exam_id, stu_id)
-                                if not sub or sub[6] != "Graded": # Status
-                                    
-                                    uploaded_file = st.session_state[file_key]
-                                    fpath = save_uploaded_file(uploaded_file)
-                                    
-                                    if fpath:
-                                        grader = AIGrader(api_key, selected_model)
-                                        res = grader.grade_submission(
-                                            fpath, 
-                                            selected_exam[4], 
-                                            selected_exam[5], 
-                                            selected_exam[6],
-                                            student_name=stu_name, # Force Name
-                                            strictness=strictness,
-                                            language=language
-                                        )
-                                        if "error" not in res:
-                                            db.save_submission(exam_id, stu_id, fpath, res)
-                                            graded_count += 1
-                            
-                            progress_bar.progress((idx + 1) / len(students))
+                        # Uploaded sheets were saved on upload; only those not graded yet are queued.
+                        tasks = []
+                        submissions = db.get_submissions_by_exam(exam_id) if exam_uploads else {}
+                        for stu_id, upload in exam_uploads.items():
+                            sub = submissions.get(stu_id)
+                            if not sub or sub[6] != "Graded": # Status
+                                tasks.append({"student_id": stu_id, "student_name": upload["name"], "image_path": upload["path"]})
                         
-                        if graded_count > 0:
-                            st.success(f"Successfully batch graded {graded_count} students!")
-                            st.rerun()
+                        if grading_mode == "Background Worker":
+                            db.enqueue_grading_jobs([(exam_id, t["student_id"], t["image_path"], strictness, language, selected_model) for t in tasks])
+                            if tasks:
+                                st.success(f"Queued {len(tasks)} answer sheets for the background worker.")
+                            else:
+                                st.info("No pending uploads found to grade.")
                         else:
-                            st.info("No pending uploads found to grade.")
+                            show_batch_summary(run_grading_batch(tasks))
                     else:
                         st.error("Select a model first.")
 
+                # --- Queue Status: resume interrupted batches, retry failures ---
+                job_counts = db.get_grading_job_counts(exam_id)
+                unfinished = job_counts.get("queued", 0) + job_counts.get("running", 0)
+                if unfinished and grading_mode == "Background Worker":
+                    finished = job_counts.get("done", 0) + job_counts.get("failed", 0)
+                    st.progress(finished / (finished + unfinished), text=f"Background worker: {job_counts.get('running', 0)} grading, {job_counts.get('queued', 0)} queued, {finished} finished")
+                    if st.button("🔄 Refresh Status"):
+                        st.rerun()
+                elif unfinished:
+                    st.warning(f"{unfinished} answer sheets are still queued from an interrupted batch.")
+                    if st.button("▶️ Resume Batch") and selected_model:
+                        show_batch_summary(run_grading_batch())
+                
+                failed_jobs = db.get_grading_jobs(exam_id, status="failed")
+                if failed_jobs:
+                    with st.expander(f"⚠️ {len(failed_jobs)} answer sheets failed to grade"):
+                        for job in failed_jobs: # (id, exam, student, name, path, strictness, language, status, attempts, error, kind, next)
+                            st.markdown(f"- **{job[3]}** · {job[10]} after {job[8]} attempts: {job[9]}")
+                        if st.button("🔁 Retry Failed Sheets") and selected_model:
+                            db.enqueue_grading_jobs([(job[1], job[2], job[4], job[5], job[6], job[12]) for job in failed_jobs])
+                            if grading_mode == "Background Worker":
+                                st.rerun()
+                            show_batch_summary(run_grading_batch())
+
+                # --- Performance Metrics: where the time goes in this process's grading ---
+                with st.expander("⏱️ Grading Performance"):
+                    batch_ids = metrics.batch_ids()
+                    if grading_mode == "Background Worker":
+                        st.caption("Batches graded by `python -m worker` are measured in the worker process; run it with `--metrics-dir` to export them.")
+                    scope_labels = {"All grading since the app started": None}
+                    for batch_id in batch_ids:
+                        batch_snapshot = metrics.snapshot(batch_id)
+                        if batch_snapshot:
+                            scope_labels[f"Batch {batch_id} ({batch_snapshot['label']})"] = batch_id
+                    scope = st.selectbox("Scope", list(scope_labels.keys()), index=1 if batch_ids else 0, key="metrics_scope")
+                    snapshot = metrics.snapshot(scope_labels[scope])
+                    if snapshot and snapshot["metrics"]:
+                        st.dataframe(
+                            [{"metric": name, **{k: v for k, v in summary.items() if k != "buckets"}} for name, summary in snapshot["metrics"].items()],
+                            use_container_width=True
+                        )
+                        st.caption("Durations in ms; payload in bytes; tokens as reported by the model. " + " · ".join(f"{name}: {count}" for name, count in snapshot["counters"].items()))
+                        hist_metric = st.selectbox("Histogram", list(snapshot["metrics"].keys()), key="metrics_histogram")
+                        st.bar_chart({f"≤{bound:g}": count for bound, count in snapshot["metrics"][hist_metric]["buckets"].items()})
+                        file_stem = f"grading_metrics_{snapshot['batch_id']}"
+                        d1, d2 = st.columns(2)
+                        d1.download_button("Export JSON", metrics.to_json(scope_labels[scope]), file_name=f"{file_stem}.json", mime="application/json")
+                        d2.download_button("Export CSV", metrics.to_csv(scope_labels[scope]), file_name=f"{file_stem}.csv", mime="text/csv")
+                    else:
+                        st.info("No grading measured yet.")
+
                 st.divider()
 
+                # Roster: one page at a time, so a rerun costs the page size rather than the class size
+                roster_counts = db.get_exam_roster_counts(cid_grad, exam_id)
+                roster_total = sum(roster_counts.values())
+                f1, f2, f3 = st.columns([3, 1, 1])
+                with f1:
+                    roster_state = st.radio("Show", [None, "pending", "graded", "failed"], format_func=lambda state: f"{(state or 'all').title()} ({roster_total if state is None else roster_counts[state]})", horizontal=True, key="roster_filter")
+                with f2:
+                    page_size = st.selectbox("Students per Page", [10, 25, 50, 100], index=1, key="roster_page_size")
+                matching = roster_total if roster_state is None else roster_counts[roster_state]
+                page_count = max(1, -(-matching // page_size))
+                with f3:
+                    page = min(st.number_input(f"Page (of {page_count})", min_value=1, value=1, key="roster_page"), page_count)
+                
+                roster = db.get_exam_roster(cid_grad, exam_id, state=roster_state, limit=page_size, offset=(page - 1) * page_size)
+                if not roster:
+                    st.info("No students match this filter.")
+                
                 # Per Student Row
-                for stu in students: # (id, name, roll, cid)
-                    stu_id = stu[0]
-                    stu_name = stu[1]
+                sheet_derivatives = get_sheet_derivatives()
+                for stu_id, stu_name, stu_roll, sub_id, sub_status, sub_updated_at, job_status, job_error, sub_image_path in roster:
+                    upload = exam_uploads.get(stu_id)
                     
                     # Card Style
-                    st.markdown(f"""<div class="student-card"><h4>👤 {stu_name} <small>({stu[2]})</small></h4></div>""", unsafe_allow_html=True)
+                    st.markdown(f"""<div class="student-card"><h4>👤 {stu_name} <small>({stu_roll})</small></h4></div>""", unsafe_allow_html=True)
                     
                     col_up, col_act = st.columns([2, 1])
                     
                     # Check submission status
-                    sub = db.get_submission(exam_id, stu_id)
-                    status = sub[6] if sub else "Not Uploaded"
+                    status = sub_status or JOB_STATUS_LABELS.get(job_status) or ("Uploaded" if upload else "Not Uploaded")
                     
                     with col_up:
                         st.caption(f"Status: {status}")
-                        # Unique key allows access in Batch Grading
-                        upl_file = st.file_uploader(f"Upload Answer Sheet", type=['jpg', 'png'], key=f"u_{stu_id}", label_visibility="collapsed")
+                        if job_status == "failed" and not sub_status:
+                            st.caption(f"Last error: {job_error}")
+                        st.file_uploader(f"Upload Answer Sheet", type=['jpg', 'png', 'pdf'], key=f"u_{exam_id}_{stu_id}", label_visibility="collapsed", on_change=stash_upload, args=(exam_id, stu_id, stu_name))
+                        thumbnail = sheet_derivatives.thumbnail_path(upload["path"] if upload else sub_image_path)
+                        if thumbnail:
+                            st.image(thumbnail, width=120)
                     
                     with col_act:
-                        if upl_file and selected_model:
+                        if upload and selected_model:
                             if st.button(f"Grade Individual", key=f"g_{stu_id}"):
                                 with st.spinner(f"Grading {stu_name}..."):
-                                    fpath = save_uploaded_file(upl_file)
-                                    if fpath:
-                                        grader = AIGrader(api_key, selected_model)
-                                        res = grader.grade_submission(
-                                            fpath, 
-                                            selected_exam[4], 
-                                            selected_exam[5], 
-                                            selected_exam[6],
-                                            student_name=stu_name, # Force Name
-                                            strictness=strictness,
-                                            language=language
-                                        )
-                                        if "error" not in res:
-                                            db.save_submission(exam_id, stu_id, fpath, res)
-                                            st.success("Graded!")
-                                            st.rerun()
-                                        else:
-                                            st.error(res['error'])
+                                    fpath = upload["path"]
+                                    live_preview = st.empty()
+                                    
+                                    def show_partial(partial):
+                                        # Streamed fields appear as soon as the model has written them
+                                        with live_preview.container():
+                                            if "total_score_obtained" in partial:
+                                                st.markdown(f"**Score:** {partial['total_score_obtained']} / {partial.get('max_score', selected_exam[6])}")
+                                            graded_questions = partial.get("question_wise_breakdown") or []
+                                            if graded_questions:
+                                                st.caption(f"{len(graded_questions)} questions graded so far")
+                                            if partial.get("overall_feedback"):
+                                                st.write(partial["overall_feedback"])
+                                    
+                                    grader = get_ai_grader(api_key, selected_model, use_context_cache)
+                                    # The upload is still in memory, so the pipeline reads its buffer instead of the stored copy
+                                    upl_file = st.session_state.get(f"u_{exam_id}_{stu_id}")
+                                    res = grader.grade_submission(
+                                        fpath, 
+                                        selected_exam[4], 
+                                        selected_exam[5], 
+                                        selected_exam[6],
+                                        student_name=stu_name, # Force Name
+                                        strictness=strictness,
+                                        language=language,
+                                        on_partial=show_partial,
+                                        image_bytes=upl_file.getbuffer() if upl_file is not None else None
+                                    )
+                                    if "error" not in res:
+                                        with metrics.span("db_write"):
+                                            db.save_submission(exam_id, stu_id, fpath, res, language=language)
+                                        st.success("Graded!")
+                                        st.rerun()
+                                    else:
+                                        st.error(res['error'])
                     
                     # Show Result if Graded
-                    if sub and sub[4]: # grades_json
-                        grades = json.loads(sub[4])
+                    grades = load_report_card(sub_id, sub_updated_at) if sub_id is not None else None
+                    if grades:
                         with st.expander("View Report Card", expanded=False):
                             st.markdown(f"""
                             <div class="report-card">
@@ -315,252 +509,69 @@ if role == "Teacher":
                                 <p><b>Feedback:</b> {grades.get('overall_feedback')}</p>
                             </div>
                             """, unsafe_allow_html=True)
+                            preview = sheet_derivatives.preview_path(sub_image_path)
+                            if preview:
+                                st.image(preview, caption="Answer sheet")
                             st.json(grades)
 
                 st.divider()
                 if st.button("📢 Publish All Results to Parents"):
                     db.publish_results(exam_id)
                     st.success("Results Published!")
+                    if selected_model:
+                        # Students with the same concepts to revise and grading language share one plan; only missing plans are generated
+                        missing_plans = db.assign_study_plans(exam_id, default_language=language)
+                        queued = get_study_plan_generator().submit(get_ai_grader(api_key, selected_model, False), missing_plans)
+                        if queued:
+                            st.info(f"Generating {queued} study plans in the background.")
+                plan_counts = db.get_study_plan_counts(exam_id)
+                if plan_counts:
+                    st.caption("Study plans: " + " · ".join(f"{count} {status}" for status, count in sorted(plan_counts.items())))
             else:
                 st.info("No exams found for this class.")
 
-# --- Parent Dashboard ---
-elif role == "Parent/Student":
-    st.markdown('<h1 class="main-header">👨‍👩‍👧 Parent Dashboard</h1>', unsafe_allow_html=True)
-    
-    all_classes = db.get_all_classes()
-    if all_classes:
-        c_opts = {c[1]: c[0] for c in all_classes}
-        p_class = st.selectbox("Select Class", list(c_opts.keys()))
-        p_cid = c_opts[p_class]
-        
-        p_students = db.get_students_by_class(p_cid)
-        if p_students:
-            s_opts = {s[1]: s[0] for s in p_students}
-            p_student_name = st.selectbox("Select Student Name", list(s_opts.keys()))
-            p_sid = s_opts[p_student_name]
-            
-            st.divider()
-            st.subheader(f"Results for {p_student_name}")
-            
-            results = db.get_student_results(p_sid) # (id, exam_name, subject, grades_json, status)
-            
-            if results:
-                for res in results:
-                    exam_name = res[1]
-                    subject = res[2]
-                    grades = json.loads(res[3])
-                    
-                    with st.expander(f"{exam_name} - {subject}", expanded=True):
-                        st.markdown(f"""
-                        <div class="report-card">
-                            <h3>{exam_name}</h3>
-                            <div class="score-big">{grades.get('total_score_obtained')} / {grades.get('max_score')}</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        st.subheader("Feedback")
-                        st.info(grades.get('overall_feedback'))
-                        
-                        st.subheader("Real World Connections 🌍")
-                        st.success(grades.get('real_world_connections', 'Not available'))
-                        
-                        st.subheader("Areas for Improvement")
-                        for p in grades.get('improvement_pointers', []):
-                            st.markdown(f"- {p}")
-            else:
-                st.info("No published results yet.")
-        else:
-            st.info("No students in this class.")
-import streamlit as st
-import os
-from ai_engine import AIGrader
-from database import DatabaseManager
-from utils import save_uploaded_file, cleanup_temp_files
-import json
-
-# Page Config
-st.set_page_config(page_title="AI Answer Grader", layout="wide", page_icon="📝")
-
-# Initialize DB
-if 'db' not in st.session_state:
-    st.session_state.db = DatabaseManager()
-
-db = st.session_state.db
-
-# Custom CSS
-st.markdown("""
-<style>
-    .main { background-color: #f5f7f9; }
-    .stButton>button { width: 100%; border-radius: 10px; height: 3em; background-color: #4CAF50; color: white; }
-    .report-card { background-color: white; padding: 20px; border-radius: 15px; box-shadow: 0 4px 6px rgba(0,0,0,0.1); margin-bottom: 20px; }
-    .score-box { font-size: 2em; font-weight: bold; color: #2c3e50; text-align: center; }
-    .status-graded { color: green; font-weight: bold; }
-    .status-pending { color: orange; font-weight: bold; }
-</style>
-""", unsafe_allow_html=True)
-
-# --- Sidebar: Auth & Settings ---
-with st.sidebar:
-    st.title("🏫 AI School Grader")
-    
-    # API Key
-    api_key = st.text_input("Gemini API Key", type="password")
-    if not api_key:
-        st.warning("Enter API Key to proceed.")
-        st.stop()
-        
-    # Model Selection
-    selected_model = None
-    try:
-        available_models = AIGrader.list_available_models(api_key)
-        if available_models:
-            selected_model = st.selectbox("AI Model", available_models, index=0)
-        else:
-            st.error("No models found.")
-    except:
-        pass
-
-    st.divider()
-    
-    # Role Selection
-    role = st.radio("Login As", ["Teacher", "Parent/Student"])
-
-# --- Teacher Dashboard ---
-if role == "Teacher":
-    st.header("👨‍🏫 Teacher Dashboard")
-    
-    tab1, tab2, tab3 = st.tabs(["Manage Classes", "Create Exam", "Grading & Results"])
-    
-    # 1. Manage Classes
-    with tab1:
-        st.subheader("Create New Class")
-        with st.form("create_class"):
-            c_name = st.text_input("Class Name (e.g., 10-A)")
-            c_level = st.selectbox("Grade Level", ["High School", "Higher Secondary", "College"])
-            if st.form_submit_button("Create Class"):
-                db.create_class(c_name, c_level)
-                st.success(f"Class {c_name} created!")
-        
-        st.subheader("Add Student to Class")
-        classes = db.get_all_classes()
-        if classes:
-            c_options = {c[1]: c[0] for c in classes}
-            selected_class_name = st.selectbox("Select Class", list(c_options.keys()))
-            selected_class_id = c_options[selected_class_name]
-            
-            with st.form("add_student"):
-                s_name = st.text_input("Student Name")
-                s_roll = st.text_input("Roll Number")
-                if st.form_submit_button("Add Student"):
-                    db.add_student(s_name, s_roll, selected_class_id)
-                    st.success(f"Student {s_name} added!")
-        else:
-            st.info("No classes found. Create one first.")
-
-    # 2. Create Exam
-    with tab2:
-        st.subheader("Schedule New Exam")
-        if classes:
-            with st.form("create_exam"):
-                e_name = st.text_input("Exam Name (e.g., Physics Mid-Term)")
-                e_subject = st.text_input("Subject")
-                e_class = st.selectbox("For Class", list(c_options.keys()), key="exam_class")
-                e_max = st.number_input("Max Marks", value=100)
-                e_qp = st.text_area("Paste Question Paper Text")
-                e_key = st.text_area("Paste Answer Key / Rubric")
-                
-                if st.form_submit_button("Create Exam"):
-                    cid = c_options[e_class]
-                    db.create_exam(e_name, e_subject, cid, e_qp, e_key, e_max)
-                    st.success(f"Exam {e_name} created!")
-        else:
-            st.warning("Create a class first.")
-
-    # 3. Grading & Results
-    with tab3:
-        st.subheader("Grading Interface")
-        
-        # Select Class -> Exam
+    # 4. Analytics
+    with tab4:
         if classes:
-            sel_class_grad = st.selectbox("Select Class", list(c_options.keys()), key="grad_class")
-            cid_grad = c_options[sel_class_grad]
-            exams = db.get_exams_by_class(cid_grad)
-            
-            if exams:
-                exam_opts = {e[1]: e for e in exams}
-                sel_exam_name = st.selectbox("Select Exam", list(exam_opts.keys()))
-                selected_exam = exam_opts[sel_exam_name] # (id, name, subj, cid, qp, key, max)
-                exam_id = selected_exam[0]
+            sel_class_an = st.selectbox("Select Class", list(c_options.keys()), key="an_class")
+            an_exams = db.get_exams_by_class(c_options[sel_class_an])
+            if an_exams:
+                an_exam_opts = {e[1]: e[0] for e in an_exams}
+                sel_exam_an = st.selectbox("Select Exam", list(an_exam_opts.keys()), key="an_exam")
+                stats = analytics.get_stats(an_exam_opts[sel_exam_an])
                 
-                # List Students
-                students = db.get_students_by_class(cid_grad)
-                
-                st.divider()
-                st.markdown(f"### Grading: {sel_exam_name}")
-                
-                # Strictness Control
-                strictness = st.select_slider("Grading Strictness", options=["Lenient", "Moderate", "Strict"], value="Moderate")
-                
-                # Per Student Row
-                for stu in students: # (id, name, roll, cid)
-                    stu_id = stu[0]
-                    stu_name = stu[1]
+                if stats["count"]:
+                    m1, m2, m3, m4 = st.columns(4)
+                    m1.metric("Graded", stats["count"])
+                    m2.metric("Average", f"{stats['mean']:.1f} / {stats['max_score'] or '-'}")
+                    m3.metric("Median", f"{stats['median']:.1f}")
+                    m4.metric("Std. Dev.", f"{stats['std']:.1f}")
+                    st.caption("Percentiles: " + " · ".join(f"P{p}: {v:.1f}" for p, v in stats["percentiles"].items()))
                     
-                    with st.expander(f"{stu_name} ({stu[2]})", expanded=False):
-                        col_up, col_act = st.columns([2, 1])
-                        
-                        # Check submission status
-                        sub = db.get_submission(exam_id, stu_id)
-                        status = sub[6] if sub else "Not Uploaded"
-                        
-                        with col_up:
-                            st.write(f"Status: **{status}**")
-                            upl_file = st.file_uploader(f"Upload Answer Sheet for {stu_name}", type=['jpg', 'png'], key=f"u_{stu_id}")
-                        
-                        with col_act:
-                            if upl_file and selected_model:
-                                if st.button(f"Grade {stu_name}", key=f"g_{stu_id}"):
-                                    with st.spinner("Grading..."):
-                                        # Save file
-                                        fpath = save_uploaded_file(upl_file)
-                                        if fpath:
-                                            grader = AIGrader(api_key, selected_model)
-                                            res = grader.grade_submission(
-                                                fpath, 
-                                                selected_exam[4], # QP
-                                                selected_exam[5], # Key
-                                                selected_exam[6], # Max
-                                                strictness=strictness
-                                            )
-                                            if "error" not in res:
-                                                db.save_submission(exam_id, stu_id, fpath, res)
-                                                st.success("Graded!")
-                                                st.rerun()
-                                            else:
-                                                st.error(res['error'])
-                        
-                        # Show Result if Graded
-                        if sub and sub[4]: # grades_json
-                            grades = json.loads(sub[4])
-                            st.info(f"Score: {grades.get('total_score_obtained')} / {grades.get('max_score')}")
-                            st.write(f"**Feedback:** {grades.get('overall_feedback')}")
-                            if st.button("View Full Report", key=f"v_{stu_id}"):
-                                st.json(grades)
-
-                st.divider()
-                if st.button("📢 Publish All Results to Parents"):
-                    db.publish_results(exam_id)
-                    st.success("Results Published!")
+                    st.subheader("Score Distribution")
+                    edges = stats["histogram"]["edges"]
+                    st.bar_chart({f"{edges[i]:g}-{edges[i + 1]:g}": count for i, count in enumerate(stats["histogram"]["counts"])})
+                    
+                    if stats["questions"]:
+                        st.subheader("Question Analysis")
+                        st.caption("Difficulty is the average fraction of marks scored (lower = harder). Discrimination compares the top and bottom 27% of the class (higher = separates strong and weak students better).")
+                        st.dataframe(stats["questions"], use_container_width=True)
+                    
+                    if stats["top_concepts"]:
+                        st.subheader("Most Common Concepts to Revise")
+                        for concept, count in stats["top_concepts"]:
+                            st.markdown(f"- **{concept}** — {count} students")
+                else:
+                    st.info("No graded submissions for this exam yet.")
             else:
                 st.info("No exams found for this class.")
+        else:
+            st.warning("Create a class first.")
 
 # --- Parent Dashboard ---
 elif role == "Parent/Student":
-    st.header("👨‍👩‍👧 Parent Dashboard")
+    st.markdown('<h1 class="main-header">👨‍👩‍👧 Parent Dashboard</h1>', unsafe_allow_html=True)
     
-    # Mock Login: Select Student
-    # In real app, this would be secure login
     all_classes = db.get_all_classes()
     if all_classes:
         c_opts = {c[1]: c[0] for c in all_classes}
@@ -576,30 +587,32 @@ elif role == "Parent/Student":
             st.divider()
             st.subheader(f"Results for {p_student_name}")
             
-            results = db.get_student_results(p_sid) # (id, exam_name, subject, grades_json, status)
+            # Render-ready report cards, precomputed at publish time and cached per student
+            results = db.get_published_reports(p_sid)
             
             if results:
-                for res in results:
-                    exam_name = res[1]
-                    subject = res[2]
-                    grades = json.loads(res[3])
-                    
-                    with st.expander(f"{exam_name} - {subject}", expanded=True):
+                for report in results:
+                    with st.expander(f"{report['exam_name']} - {report['subject']}", expanded=True):
                         st.markdown(f"""
                         <div class="report-card">
-                            <div class="score-box">{grades.get('total_score_obtained')} / {grades.get('max_score')}</div>
+                            <h3>{report['exam_name']}</h3>
+                            <div class="score-big">{report['score']}</div>
                         </div>
                         """, unsafe_allow_html=True)
                         
                         st.subheader("Feedback")
-                        st.write(grades.get('overall_feedback'))
+                        st.info(report['overall_feedback'])
                         
                         st.subheader("Real World Connections 🌍")
-                        st.info(grades.get('real_world_connections', 'Not available'))
+                        st.success(report['real_world_connections'])
                         
                         st.subheader("Areas for Improvement")
-                        for p in grades.get('improvement_pointers', []):
+                        for p in report['improvement_pointers']:
                             st.markdown(f"- {p}")
+                        
+                        if report.get('study_plan'):
+                            st.subheader("Study Plan 📚")
+                            st.markdown(report['study_plan'])
             else:
                 st.info("No published results yet.")
         else:
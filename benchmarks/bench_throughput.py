@@ -0,0 +1,185 @@
+"""
+End-to-end grading throughput benchmark.
+
+Usage:
+    python -m benchmarks.bench_throughput [--sheets 200] [--concurrency 1,4,8,16] [--latency 0.05] [--error-rate 0.02]
+
+Drives BatchGrader and DatabaseManager against the offline FakeBackend, so no API key or network is
+needed: sheets are queued, claimed, "graded" with the configured latency distribution and error
+rate, and saved through the real job queue. For each concurrency level it reports sheets/sec,
+p50/p95 model-call latency as seen by the batch path (image preparation included) and peak traced
+memory. Run it before and after a change with the same arguments and compare the tables.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from ai_engine import AIGrader
+from benchmarks.bench_images import synthetic_sheet
+from database import DatabaseManager
+from grading_engine import BatchGrader, RetryPolicy
+from model_backends import FakeBackend
+
+
+class TimedGrader:
+    """
+    Wraps an AIGrader and records the wall time of every grading call, per sheet.
+    """
+    def __init__(self, grader):
+        self.grader = grader
+        self.model_name = grader.model_name
+        self.lock = threading.Lock()
+        self.latencies = []
+
+    def _record(self, seconds, sheets=1):
+        with self.lock:
+            self.latencies.extend([seconds] * sheets)
+
+    def grade_submission(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.grader.grade_submission(*args, **kwargs)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def grade_submissions_packed(self, sheets, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.grader.grade_submissions_packed(sheets, *args, **kwargs)
+        finally:
+            self._record(time.perf_counter() - start, len(sheets))
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def make_sheets(directory, count, width, height, variants=8):
+    """
+    Writes `count` answer sheet photos. A few distinct images are reused so setup stays quick.
+    """
+    images = [synthetic_sheet(width, height, seed=i) for i in range(min(variants, count))]
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"sheet_{i:05d}.jpg")
+        with open(path, "wb") as f:
+            f.write(images[i % len(images)])
+        paths.append(path)
+    return paths
+
+
+def run_level(db, class_id, students, paths, concurrency, args):
+    backend = FakeBackend(
+        latency_median=args.latency,
+        latency_sigma=args.sigma,
+        error_rate=args.error_rate,
+        questions=args.questions,
+        feedback_chars=args.feedback_chars,
+        seed=args.seed,
+    )
+    grader = TimedGrader(AIGrader(None, backend.model_name, backend=backend))
+    exam_id = db.create_exam(f"Benchmark x{concurrency}", "Science", class_id, "Answer all questions.", "Award marks per rubric.", 5 * args.questions)
+    exam = db.get_exam_by_id(exam_id)
+    tasks = [{"student_id": sid, "student_name": name, "image_path": path} for (sid, name), path in zip(students, paths)]
+
+    batch = BatchGrader(
+        grader,
+        db,
+        max_workers=concurrency,
+        requests_per_minute=0,
+        pack_size=args.pack_size,
+        poll_interval=0.05,
+        retry_policy=RetryPolicy(base_delay=0.0, rate_limit_delay=0.0, rng=random.Random(args.seed)),
+    )
+
+    if args.trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    summary = batch.run(exam, tasks)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    read_start = time.perf_counter()
+    submissions = db.get_submissions_by_exam(exam_id)
+    read_ms = (time.perf_counter() - read_start) * 1000
+
+    return {
+        "concurrency": concurrency,
+        "sheets": len(tasks),
+        "graded": summary["graded"],
+        "failed": summary["failed"],
+        "retried": summary["retried"],
+        "saved": len(submissions),
+        "seconds": elapsed,
+        "sheets_per_sec": summary["graded"] / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(grader.latencies, 50) * 1000,
+        "p95_ms": percentile(grader.latencies, 95) * 1000,
+        "model_calls": backend.calls,
+        "peak_mb": peak / 2 ** 20 if peak is not None else None,
+        "read_ms": read_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sheets", type=int, default=200)
+    parser.add_argument("--concurrency", default="1,4,8,16", help="Comma-separated worker counts")
+    parser.add_argument("--latency", type=float, default=0.05, help="Median fake model latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Log-normal latency spread")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--questions", type=int, default=10, help="Questions per fake reply")
+    parser.add_argument("--feedback-chars", type=int, default=200, help="Feedback length per field in fake replies")
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--sheet-size", default="1600x1200", help="Synthetic sheet dimensions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="Skip tracemalloc (it slows allocation-heavy code down)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    width, height = (int(v) for v in args.sheet_size.lower().split("x"))
+    workdir = tempfile.mkdtemp(prefix="bench_throughput_")
+    db = DatabaseManager(os.path.join(workdir, "bench.db"))
+    try:
+        paths = make_sheets(workdir, args.sheets, width, height)
+        class_id = db.create_class("Benchmark", "10")
+        with db.transaction():
+            db.add_students([(f"Student {i}", f"R{i:05d}", class_id) for i in range(args.sheets)])
+        students = [(s[0], s[1]) for s in db.get_students_by_class(class_id)]
+
+        rows = [run_level(db, class_id, students, paths, c, args) for c in levels]
+    finally:
+        db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'workers':>7} {'graded':>7} {'failed':>7} {'retried':>8} {'sheets/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'peak MB':>8} {'read ms':>8}")
+    for r in rows:
+        peak = f"{r['peak_mb']:>8.1f}" if r["peak_mb"] is not None else f"{'-':>8}"
+        print(f"{r['concurrency']:>7} {r['graded']:>7} {r['failed']:>7} {r['retried']:>8} {r['sheets_per_sec']:>9.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {peak} {r['read_ms']:>8.1f}")
+    if rows:
+        best = max(rows, key=lambda r: r["sheets_per_sec"])
+        print(f"\nbest: {best['sheets_per_sec']:.1f} sheets/s at {best['concurrency']} workers "
+              f"(median of {statistics.median(r['sheets_per_sec'] for r in rows):.1f} across levels)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
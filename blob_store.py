@@ -0,0 +1,126 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded answer sheets.
+
+    Each blob is saved once under `root/<ab>/<cd>/<sha256>`, so identical uploads share one file,
+    re-uploads and regrades write nothing, and two students' `scan.jpg` can never collide. Blobs
+    are immutable; unreferenced ones are removed by `collect_garbage`.
+    """
+    def __init__(self, root="blobs"):
+        self.root = root
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        """
+        Stores `data` (bytes or any buffer, e.g. a memoryview of an upload) and returns its path.
+        """
+        digest = self.digest(data)
+        path = self.path(digest)
+        if os.path.exists(path):
+            # Refresh the age so a re-uploaded blob gets a full grace period before garbage collection.
+            os.utime(path)
+            return path
+        self.write_file(path, data)
+        return path
+
+    @staticmethod
+    def write_file(path, data):
+        """
+        Writes to a temporary name and renames, so readers never see a partial file.
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def remove(self, digest):
+        """
+        Deletes a blob and any files stored alongside it (`<digest>.*`, e.g. derivatives). Returns bytes freed.
+        """
+        path = self.path(digest)
+        directory = os.path.dirname(path)
+        freed = 0
+        if not os.path.isdir(directory):
+            return freed
+        for name in os.listdir(directory):
+            if name == digest or name.startswith(digest + "."):
+                try:
+                    full_path = os.path.join(directory, name)
+                    freed += os.path.getsize(full_path)
+                    os.remove(full_path)
+                except FileNotFoundError:
+                    pass
+        return freed
+
+    def digest_of(self, path):
+        """
+        Returns the digest of a path inside this store, or None for any other path.
+        """
+        if not path:
+            return None
+        name = os.path.basename(path)
+        if DIGEST_PATTERN.fullmatch(name) and os.path.abspath(path) == os.path.abspath(self.path(name)):
+            return name
+        return None
+
+    def iter_blobs(self):
+        """
+        Yields (digest, path) for every stored blob.
+        """
+        if not os.path.isdir(self.root):
+            return
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if DIGEST_PATTERN.fullmatch(name):
+                    yield name, os.path.join(directory, name)
+
+    def collect_garbage(self, refcounts, min_age_seconds=24 * 3600, clock=time.time):
+        """
+        Deletes blobs (with their derivatives) that have no references in `refcounts`
+        ({path or digest: count}) and are older than `min_age_seconds`. The grace period keeps sheets that were uploaded but not graded yet.
+        Returns (blobs removed, bytes freed).
+        """
+        referenced = set()
+        for ref, count in refcounts.items():
+            if count > 0:
+                referenced.add(ref if DIGEST_PATTERN.fullmatch(ref or "") else self.digest_of(ref))
+        removed = 0
+        freed = 0
+        cutoff = clock() - min_age_seconds
+        for digest, path in list(self.iter_blobs()):
+            if digest in referenced:
+                continue
+            try:
+                if os.stat(path).st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += self.remove(digest)
+        return removed, freed
+
+    def stats(self):
+        sizes = [os.path.getsize(path) for _, path in self.iter_blobs()]
+        return {"blobs": len(sizes), "size_bytes": sum(sizes)}
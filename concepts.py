@@ -0,0 +1,22 @@
+import hashlib
+import json
+
+
+def normalise_concept(concept):
+    return " ".join(str(concept).split()).strip().lower()
+
+
+def plan_concepts(grades):
+    """
+    The sorted, de-duplicated, normalised `concepts_to_revise` of a grading result.
+    """
+    if not isinstance(grades, dict):
+        return []
+    return sorted({c for c in (normalise_concept(c) for c in grades.get("concepts_to_revise") or []) if c})
+
+
+def study_plan_key(concepts, language):
+    """
+    Students with the same concepts to revise and feedback language share one plan under this key.
+    """
+    return hashlib.sha256(json.dumps([language, sorted(concepts)]).encode("utf-8")).hexdigest()
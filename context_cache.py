@@ -0,0 +1,150 @@
+import datetime
+import hashlib
+import threading
+import time
+import uuid
+
+
+class LocalContextBackend:
+    """
+    Offline stand-in for provider-side context caching.
+
+    The context text is kept in memory and prepended to every request made through the bound
+    model, so behaviour matches the real cache without any network access.
+    """
+    def __init__(self):
+        self.contexts = {}
+        self.created = 0
+        self.deleted = 0
+
+    def create(self, model_name, context, ttl_seconds):
+        handle = uuid.uuid4().hex
+        self.contexts[handle] = context
+        self.created += 1
+        return handle
+
+    def bind(self, handle, model):
+        return _PrefixedModel(model, self.contexts[handle])
+
+    def delete(self, handle):
+        if self.contexts.pop(handle, None) is not None:
+            self.deleted += 1
+
+
+class _PrefixedModel:
+    def __init__(self, model, context):
+        self.model = model
+        self.context = context
+
+    def generate_content(self, contents, **kwargs):
+        if not isinstance(contents, list):
+            contents = [contents]
+        return self.model.generate_content([self.context] + contents, **kwargs)
+
+
+class GeminiContextBackend:
+    """
+    Gemini context caching: the exam context is uploaded once and referenced by handle.
+    """
+    def create(self, model_name, context, ttl_seconds):
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=model_name,
+            contents=[context],
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+
+    def bind(self, handle, model):
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+    def delete(self, handle):
+        handle.delete()
+
+
+class ExamContextCache:
+    """
+    One cached-context handle per (model, exam context), valid for `ttl_seconds`.
+
+    Handles are created on first use and recreated after they expire. If the backend refuses a
+    context (e.g. it is below the provider's minimum cacheable size), that context is remembered
+    as uncacheable for the TTL and callers fall back to sending the raw text.
+    """
+    def __init__(self, backend=None, ttl_seconds=3600, clock=time.time):
+        self.backend = backend or GeminiContextBackend()
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> (handle or None, expires_at)
+        self.last_used = {}  # key -> time of the last get()
+        self.key_locks = {}
+        self.last_error = None
+
+    @staticmethod
+    def make_key(model_name, context):
+        return hashlib.sha256(f"{model_name}\x00{context}".encode("utf-8")).hexdigest()
+
+    def get(self, model_name, context):
+        """
+        Returns a live handle for this context, or None if it can't be cached.
+        """
+        key = self.make_key(model_name, context)
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+            self.last_used[key] = self.clock()
+        # Per-key lock: concurrent sheets of the same exam wait for one upload instead of racing.
+        with key_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+            now = self.clock()
+            if entry is not None and entry[1] > now:
+                return entry[0]
+            if entry is not None and entry[0] is not None:
+                self._delete(entry[0])
+            try:
+                # Expire locally a little early so a handle is never used right as the provider drops it.
+                handle = self.backend.create(model_name, context, self.ttl_seconds)
+                expires_at = now + self.ttl_seconds * 0.9
+            except Exception as e:
+                self.last_error = str(e)
+                handle, expires_at = None, now + self.ttl_seconds
+            with self.lock:
+                self.entries[key] = (handle, expires_at)
+            return handle
+
+    def bind(self, handle, model):
+        return self.backend.bind(handle, model)
+
+    def _delete(self, handle):
+        try:
+            self.backend.delete(handle)
+        except Exception:
+            pass
+
+    def release_all(self):
+        """
+        Deletes every live handle, e.g. when a grading session ends.
+        """
+        with self.lock:
+            entries, self.entries = self.entries, {}
+            self.last_used.clear()
+        for handle, _ in entries.values():
+            if handle is not None:
+                self._delete(handle)
+
+    def release_idle(self, idle_seconds):
+        """
+        Deletes handles that no sheet has used for `idle_seconds`, so a context stops being billed
+        soon after grading moves on to another exam or model rather than after the full TTL.
+        Returns how many handles were deleted.
+        """
+        cutoff = self.clock() - idle_seconds
+        with self.lock:
+            idle = [key for key in self.entries if self.last_used.get(key, 0) <= cutoff]
+            handles = [self.entries.pop(key)[0] for key in idle]
+            for key in idle:
+                self.last_used.pop(key, None)
+        for handle in handles:
+            if handle is not None:
+                self._delete(handle)
+        return sum(handle is not None for handle in handles)
@@ -1,11 +1,125 @@
 import sqlite3
 import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from report_cards import ReportCardCache, build_report_card
+from concepts import plan_concepts, study_plan_key
+
+SCHEMA_VERSION = 9
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def score_rows(grades):
+    """
+    Extracts (total_score_obtained, max_score, question rows) from a grading result dict.
+    Each question row is (question_number, marks_obtained, max_marks, status).
+    """
+    questions = []
+    for q in grades.get("question_wise_breakdown") or []:
+        if isinstance(q, dict):
+            questions.append((
+                str(q.get("question_number", "")),
+                _to_float(q.get("marks_obtained")),
+                _to_float(q.get("max_marks")),
+                q.get("status"),
+            ))
+    return _to_float(grades.get("total_score_obtained")), _to_float(grades.get("max_score")), questions
+
+def _load_grades(grades_json):
+    try:
+        grades = json.loads(grades_json)
+    except (TypeError, ValueError):
+        return None
+    return grades if isinstance(grades, dict) else None
+
+
+class ConnectionPool:
+    """
+    Hands out one SQLite connection per thread.
+
+    File databases run in WAL mode, so readers never block the writer, and every connection
+    waits up to `timeout` seconds on a lock instead of failing with "database is locked".
+    Connections owned by threads that have exited are closed the next time a thread connects.
+    """
+    def __init__(self, db_name, timeout=30.0):
+        self.timeout = timeout
+        self.uri = False
+        self.keepalive = None
+        if db_name == ":memory:":
+            # Give every thread the same private in-memory database.
+            db_name = f"file:memdb-{uuid.uuid4().hex}?mode=memory&cache=shared"
+            self.uri = True
+        self.db_name = db_name
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = {}  # thread ident -> connection
+        if self.uri:
+            self.keepalive = self.get()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False, uri=self.uri)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        if not self.uri:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def get(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self.local.conn = conn
+            with self.lock:
+                self._prune()
+                self.connections[threading.get_ident()] = conn
+        return conn
+
+    def _prune(self):
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self.connections if i not in alive]:
+            stale = self.connections.pop(ident)
+            if stale is not self.keepalive:
+                stale.close()
+
+    def close_all(self):
+        with self.lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections.clear()
+        self.local = threading.local()
+
 
 class DatabaseManager:
-    def __init__(self, db_name="school_grades.db"):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+    def __init__(self, db_name="school_grades.db", timeout=30.0):
+        self.pool = ConnectionPool(db_name, timeout=timeout)
+        self._local = threading.local()
+        self.report_cards = ReportCardCache()
         self.create_tables()
 
+    @property
+    def conn(self):
+        """
+        The calling thread's connection.
+        """
+        return self.pool.get()
+
+    @property
+    def _batch_depth(self):
+        return getattr(self._local, "batch_depth", 0)
+
+    @_batch_depth.setter
+    def _batch_depth(self, value):
+        self._local.batch_depth = value
+
     def create_tables(self):
         cursor = self.conn.cursor()
         
@@ -53,17 +167,231 @@ class DatabaseManager:
             grades_json TEXT,
             teacher_feedback TEXT,
             status TEXT DEFAULT 'Pending', -- Pending, Graded, Published
+            total_score_obtained REAL,
+            max_score REAL,
+            updated_at REAL,
+            report_json TEXT, -- render-ready report card, set when published
+            study_plan_key TEXT, -- shared plan in study_plans, assigned when published
             FOREIGN KEY (exam_id) REFERENCES exams (id),
-            FOREIGN KEY (student_id) REFERENCES students (id)
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            UNIQUE (exam_id, student_id)
+        )
+        ''')
+
+        # Study plans, shared by every student with the same concepts to revise and language
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS study_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_key TEXT NOT NULL UNIQUE,
+            language TEXT,
+            concepts_json TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, ready, failed
+            plan_markdown TEXT,
+            last_error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+        ''')
+
+        # Per-question marks, mirrored from question_wise_breakdown in grades_json
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS submission_questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            submission_id INTEGER NOT NULL,
+            exam_id INTEGER NOT NULL,
+            question_number TEXT,
+            marks_obtained REAL,
+            max_marks REAL,
+            status TEXT,
+            FOREIGN KEY (submission_id) REFERENCES submissions (id),
+            FOREIGN KEY (exam_id) REFERENCES exams (id)
+        )
+        ''')
+
+        # Grading Jobs Table (durable batch queue)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grading_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            exam_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            image_path TEXT NOT NULL,
+            strictness TEXT,
+            language TEXT,
+            model_name TEXT,
+            status TEXT NOT NULL DEFAULT 'queued', -- queued, running, done, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            error_kind TEXT, -- rate_limit, transient, permanent
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            claim_id TEXT, -- set on every claim; results are only accepted from the current claim
+            created_at REAL,
+            updated_at REAL,
+            FOREIGN KEY (exam_id) REFERENCES exams (id),
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            UNIQUE (exam_id, student_id)
         )
         ''')
         self.conn.commit()
+        self.migrate()
+
+    def migrate(self):
+        """
+        Brings databases created by older versions up to SCHEMA_VERSION, tracked in PRAGMA user_version.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        cursor.execute("BEGIN")
+        if version < 1:
+            self._add_submission_uniqueness(cursor)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_students_class ON students (class_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_exams_class ON exams (class_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_student ON submissions (student_id, status)")
+        if version < 2:
+            self._add_score_columns(cursor)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_exam_score ON submissions (exam_id, total_score_obtained)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_submission_questions_submission ON submission_questions (submission_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_submission_questions_exam ON submission_questions (exam_id, question_number)")
+        if version < 3:
+            cursor.execute("PRAGMA table_info(submissions)")
+            if "updated_at" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE submissions ADD COLUMN updated_at REAL")
+            cursor.execute("UPDATE submissions SET updated_at = ? WHERE updated_at IS NULL", (time.time(),))
+        if version < 4:
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_grading_jobs_status ON grading_jobs (status, next_attempt_at)")
+        if version < 5:
+            cursor.execute("PRAGMA table_info(grading_jobs)")
+            if "model_name" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE grading_jobs ADD COLUMN model_name TEXT")
+        if version < 6:
+            self._add_report_cards(cursor)
+        if version < 7:
+            cursor.execute("PRAGMA table_info(submissions)")
+            if "study_plan_key" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE submissions ADD COLUMN study_plan_key TEXT")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_study_plan ON submissions (study_plan_key)")
+        if version < 8:
+            cursor.execute("PRAGMA table_info(grading_jobs)")
+            if "claim_id" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE grading_jobs ADD COLUMN claim_id TEXT")
+        if version < 9:
+            cursor.execute("PRAGMA table_info(submissions)")
+            if "language" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE submissions ADD COLUMN language TEXT")
+            # Sheets graded through the queue recorded their feedback language on the job.
+            cursor.execute("""
+                UPDATE submissions SET language = (
+                    SELECT j.language FROM grading_jobs j
+                    WHERE j.exam_id = submissions.exam_id AND j.student_id = submissions.student_id
+                )
+                WHERE language IS NULL
+            """)
+
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def _add_submission_uniqueness(self, cursor):
+        # SQLite can't add a constraint in place, so older tables are rebuilt keeping the newest row per student.
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'submissions'")
+        if "UNIQUE (exam_id, student_id)" in cursor.fetchone()[0]:
+            return
+        cursor.execute("ALTER TABLE submissions RENAME TO submissions_old")
+        cursor.execute('''
+        CREATE TABLE submissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            exam_id INTEGER,
+            student_id INTEGER,
+            image_path TEXT,
+            grades_json TEXT,
+            teacher_feedback TEXT,
+            status TEXT DEFAULT 'Pending', -- Pending, Graded, Published
+            FOREIGN KEY (exam_id) REFERENCES exams (id),
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            UNIQUE (exam_id, student_id)
+        )
+        ''')
+        cursor.execute("""
+            INSERT INTO submissions (id, exam_id, student_id, image_path, grades_json, teacher_feedback, status)
+            SELECT id, exam_id, student_id, image_path, grades_json, teacher_feedback, status
+            FROM submissions_old
+            WHERE id IN (SELECT MAX(id) FROM submissions_old GROUP BY exam_id, student_id)
+        """)
+        cursor.execute("DROP TABLE submissions_old")
+
+    def _add_score_columns(self, cursor):
+        cursor.execute("PRAGMA table_info(submissions)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "total_score_obtained" not in columns:
+            cursor.execute("ALTER TABLE submissions ADD COLUMN total_score_obtained REAL")
+        if "max_score" not in columns:
+            cursor.execute("ALTER TABLE submissions ADD COLUMN max_score REAL")
+
+        # Backfill structured scores from the JSON blobs written by older versions.
+        cursor.execute("SELECT id, exam_id, grades_json FROM submissions WHERE grades_json IS NOT NULL")
+        for submission_id, exam_id, grades_json in cursor.fetchall():
+            try:
+                grades = json.loads(grades_json)
+            except ValueError:
+                continue
+            if not isinstance(grades, dict):
+                continue
+            total, max_score, questions = score_rows(grades)
+            cursor.execute("UPDATE submissions SET total_score_obtained = ?, max_score = ? WHERE id = ?", (total, max_score, submission_id))
+            cursor.execute("DELETE FROM submission_questions WHERE submission_id = ?", (submission_id,))
+            cursor.executemany("""
+                INSERT INTO submission_questions (submission_id, exam_id, question_number, marks_obtained, max_marks, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(submission_id, exam_id) + q for q in questions])
+
+    def _add_report_cards(self, cursor):
+        cursor.execute("PRAGMA table_info(submissions)")
+        if "report_json" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE submissions ADD COLUMN report_json TEXT")
+        # Results published by older versions get their report card now.
+        cursor.execute("""
+            SELECT s.id, e.name, e.subject, s.grades_json, s.updated_at
+            FROM submissions s JOIN exams e ON s.exam_id = e.id
+            WHERE s.status = 'Published' AND s.report_json IS NULL AND s.grades_json IS NOT NULL
+        """)
+        updates = []
+        for submission_id, exam_name, subject, grades_json, updated_at in cursor.fetchall():
+            grades = _load_grades(grades_json)
+            if grades is not None:
+                updates.append((json.dumps(build_report_card(exam_name, subject, grades, updated_at)), submission_id))
+        cursor.executemany("UPDATE submissions SET report_json = ? WHERE id = ?", updates)
+
+    # --- Transactions ---
+    @contextmanager
+    def transaction(self):
+        """
+        Groups writes into a single transaction. Write methods called inside skip their own commit;
+        everything is committed once on exit, or rolled back if the block raises. Blocks may nest.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.conn.rollback()
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self.conn.commit()
+
+    def _commit(self):
+        if self._batch_depth == 0:
+            self.conn.commit()
 
     # --- Class Methods ---
     def create_class(self, name, grade_level):
         cursor = self.conn.cursor()
         cursor.execute("INSERT INTO classes (name, grade_level) VALUES (?, ?)", (name, grade_level))
-        self.conn.commit()
+        self._commit()
         return cursor.lastrowid
 
     def get_all_classes(self):
@@ -80,7 +408,16 @@ class DatabaseManager:
     def add_student(self, name, roll_number, class_id):
         cursor = self.conn.cursor()
         cursor.execute("INSERT INTO students (name, roll_number, class_id) VALUES (?, ?, ?)", (name, roll_number, class_id))
-        self.conn.commit()
+        self._commit()
+
+    def add_students(self, students):
+        """
+        Bulk-inserts (name, roll_number, class_id) rows with a single executemany.
+        """
+        cursor = self.conn.cursor()
+        cursor.executemany("INSERT INTO students (name, roll_number, class_id) VALUES (?, ?, ?)", students)
+        self._commit()
+        return cursor.rowcount
 
     def get_students_by_class(self, class_id):
         cursor = self.conn.cursor()
@@ -99,7 +436,7 @@ class DatabaseManager:
             INSERT INTO exams (name, subject, class_id, question_paper_text, answer_key_text, max_marks) 
             VALUES (?, ?, ?, ?, ?, ?)
         """, (name, subject, class_id, qp_text, ans_key_text, max_marks))
-        self.conn.commit()
+        self._commit()
         return cursor.lastrowid
 
     def get_exams_by_class(self, class_id):
@@ -118,28 +455,488 @@ class DatabaseManager:
         cursor.execute("SELECT * FROM submissions WHERE exam_id = ? AND student_id = ?", (exam_id, student_id))
         return cursor.fetchone()
 
-    def save_submission(self, exam_id, student_id, image_path, grades_json, status="Graded"):
+    def get_submissions_by_exam(self, exam_id):
+        """
+        Returns every submission for an exam in one query, as a dict keyed by student_id.
+        """
         cursor = self.conn.cursor()
-        # Check if exists
-        existing = self.get_submission(exam_id, student_id)
-        if existing:
-            cursor.execute("""
-                UPDATE submissions 
-                SET image_path = ?, grades_json = ?, status = ?
+        cursor.execute("SELECT * FROM submissions WHERE exam_id = ?", (exam_id,))
+        return {row[2]: row for row in cursor.fetchall()}
+
+    def get_submission_grades(self, submission_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT grades_json FROM submissions WHERE id = ?", (submission_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    ROSTER_FILTERS = {
+        "graded": "sub.grades_json IS NOT NULL",
+        "failed": "sub.grades_json IS NULL AND j.status = 'failed'",
+        "pending": "sub.grades_json IS NULL AND (j.status IS NULL OR j.status != 'failed')",
+    }
+    ROSTER_FROM = """
+        FROM students st
+        LEFT JOIN submissions sub ON sub.student_id = st.id AND sub.exam_id = ?
+        LEFT JOIN grading_jobs j ON j.student_id = st.id AND j.exam_id = ?
+        WHERE st.class_id = ?
+    """
+
+    def get_exam_roster(self, class_id, exam_id, state=None, limit=25, offset=0):
+        """
+        Returns one page of a class's roster for an exam, optionally only students whose sheet is
+        "pending", "graded" or "failed". Rows are (student_id, name, roll_number, submission_id,
+        submission_status, updated_at, job_status, job_error, image_path); grades_json is not loaded.
+        """
+        query = f"""
+            SELECT st.id, st.name, st.roll_number, sub.id, sub.status, sub.updated_at, j.status, j.last_error, sub.image_path
+            {self.ROSTER_FROM}
+        """
+        if state is not None:
+            query += f" AND {self.ROSTER_FILTERS[state]}"
+        cursor = self.conn.cursor()
+        cursor.execute(query + " ORDER BY st.id LIMIT ? OFFSET ?", (exam_id, exam_id, class_id, limit, offset))
+        return cursor.fetchall()
+
+    def get_exam_roster_counts(self, class_id, exam_id):
+        """
+        Returns {"pending": n, "graded": n, "failed": n} for a class's roster on an exam.
+        """
+        columns = ", ".join(f"COALESCE(SUM({condition}), 0)" for condition in self.ROSTER_FILTERS.values())
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {columns} {self.ROSTER_FROM}", (exam_id, exam_id, class_id))
+        return dict(zip(self.ROSTER_FILTERS, cursor.fetchone()))
+
+    SAVE_SUBMISSION_SQL = """
+        INSERT INTO submissions (exam_id, student_id, image_path, grades_json, language, status, total_score_obtained, max_score, updated_at, report_json, study_plan_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL)
+        ON CONFLICT (exam_id, student_id) DO UPDATE SET
+            image_path = excluded.image_path,
+            grades_json = excluded.grades_json,
+            language = excluded.language,
+            status = excluded.status,
+            total_score_obtained = excluded.total_score_obtained,
+            max_score = excluded.max_score,
+            updated_at = excluded.updated_at,
+            report_json = NULL,
+            study_plan_key = NULL
+    """
+
+    def save_submission(self, exam_id, student_id, image_path, grades_json, language=None, status="Graded"):
+        self.save_submissions([(exam_id, student_id, image_path, grades_json, language)], status=status)
+
+    def save_submissions(self, submissions, status="Graded"):
+        """
+        Bulk-upserts (exam_id, student_id, image_path, grades_json, language) rows with a single executemany,
+        keeping the score columns and submission_questions in step with each grades_json.
+        `language` is the feedback language the sheet was graded in.
+        A regraded submission loses its published report card and study plan until it is published again.
+        """
+        rows = []
+        questions = []
+        now = time.time()
+        for exam_id, student_id, image_path, grades_json, language in submissions:
+            total, max_score, question_rows = score_rows(grades_json)
+            rows.append((exam_id, student_id, image_path, json.dumps(grades_json), language, status, total, max_score, now))
+            questions.extend((exam_id, student_id, exam_id) + q for q in question_rows)
+
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.executemany(self.SAVE_SUBMISSION_SQL, rows)
+            cursor.executemany("""
+                DELETE FROM submission_questions
+                WHERE submission_id = (SELECT id FROM submissions WHERE exam_id = ? AND student_id = ?)
+            """, [(r[0], r[1]) for r in rows])
+            cursor.executemany("""
+                INSERT INTO submission_questions (submission_id, exam_id, question_number, marks_obtained, max_marks, status)
+                VALUES ((SELECT id FROM submissions WHERE exam_id = ? AND student_id = ?), ?, ?, ?, ?, ?)
+            """, questions)
+        self.report_cards.invalidate({r[1] for r in rows})
+
+    def get_submission_versions(self, exam_id):
+        """
+        Returns {student_id: updated_at} for an exam, to detect which submissions changed.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT student_id, updated_at FROM submissions WHERE exam_id = ?", (exam_id,))
+        return dict(cursor.fetchall())
+
+    def get_exam_results(self, exam_id, student_ids=None):
+        """
+        Returns (student_id, total_score_obtained, max_score, grades_json, updated_at) rows for an exam,
+        optionally limited to `student_ids`.
+        """
+        query = "SELECT student_id, total_score_obtained, max_score, grades_json, updated_at FROM submissions WHERE exam_id = ?"
+        return self._fetch_for_students(query, exam_id, student_ids)
+
+    def get_exam_question_marks(self, exam_id, student_ids=None):
+        """
+        Returns (student_id, question_number, marks_obtained, max_marks) rows for an exam,
+        optionally limited to `student_ids`.
+        """
+        query = """
+            SELECT s.student_id, q.question_number, q.marks_obtained, q.max_marks
+            FROM submission_questions q
+            JOIN submissions s ON q.submission_id = s.id
+            WHERE q.exam_id = ?
+        """
+        return self._fetch_for_students(query, exam_id, student_ids, column="s.student_id")
+
+    def _fetch_for_students(self, query, exam_id, student_ids, column="student_id", chunk_size=500):
+        cursor = self.conn.cursor()
+        if student_ids is None:
+            cursor.execute(query, (exam_id,))
+            return cursor.fetchall()
+        student_ids = list(student_ids)
+        rows = []
+        for i in range(0, len(student_ids), chunk_size):
+            chunk = student_ids[i:i + chunk_size]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(f"{query} AND {column} IN ({placeholders})", [exam_id] + chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    # --- Score Aggregates ---
+    def get_exam_score_summary(self, exam_id):
+        """
+        Returns (graded_count, average, lowest, highest) of total_score_obtained for an exam.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(total_score_obtained), AVG(total_score_obtained), MIN(total_score_obtained), MAX(total_score_obtained)
+            FROM submissions WHERE exam_id = ?
+        """, (exam_id,))
+        return cursor.fetchone()
+
+    def get_top_students(self, exam_id, limit=10):
+        """
+        Returns (student_id, name, roll_number, total_score_obtained, max_score) rows, best first.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT st.id, st.name, st.roll_number, s.total_score_obtained, s.max_score
+            FROM submissions s
+            JOIN students st ON s.student_id = st.id
+            WHERE s.exam_id = ? AND s.total_score_obtained IS NOT NULL
+            ORDER BY s.total_score_obtained DESC
+            LIMIT ?
+        """, (exam_id, limit))
+        return cursor.fetchall()
+
+    def get_question_stats(self, exam_id):
+        """
+        Returns (question_number, attempts, avg_marks, max_marks) per question for an exam.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT question_number, COUNT(*), AVG(marks_obtained), MAX(max_marks)
+            FROM submission_questions
+            WHERE exam_id = ?
+            GROUP BY question_number
+            ORDER BY CAST(question_number AS INTEGER), question_number
+        """, (exam_id,))
+        return cursor.fetchall()
+
+    # --- Grading Job Queue ---
+    def enqueue_grading_jobs(self, jobs):
+        """
+        Queues (exam_id, student_id, image_path, strictness, language, model_name) rows for grading.
+        A sheet that already has a job is reset to queued with a fresh attempt count.
+        """
+        now = time.time()
+        cursor = self.conn.cursor()
+        cursor.executemany("""
+            INSERT INTO grading_jobs (exam_id, student_id, image_path, strictness, language, model_name, status, attempts, next_attempt_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, 0, ?, ?)
+            ON CONFLICT (exam_id, student_id) DO UPDATE SET
+                image_path = excluded.image_path,
+                strictness = excluded.strictness,
+                language = excluded.language,
+                model_name = excluded.model_name,
+                status = 'queued',
+                attempts = 0,
+                last_error = NULL,
+                error_kind = NULL,
+                next_attempt_at = 0,
+                lease_until = NULL,
+                claim_id = NULL,
+                updated_at = excluded.updated_at
+        """, [tuple(job) + (now, now) for job in jobs])
+        self._commit()
+
+    GRADING_JOB_COLUMNS = """
+        j.id, j.exam_id, j.student_id, st.name, j.image_path, j.strictness, j.language,
+        j.status, j.attempts, j.last_error, j.error_kind, j.next_attempt_at, j.model_name, j.claim_id
+    """
+
+    def claim_grading_jobs(self, limit, exam_id=None, lease_seconds=300, model_only=False):
+        """
+        Atomically marks up to `limit` due jobs as running and returns them as
+        (id, exam_id, student_id, student_name, image_path, strictness, language, status, attempts, last_error, error_kind, next_attempt_at, model_name, claim_id) rows.
+        Every claim gets a fresh random `claim_id`; results must quote it to be accepted.
+        Running jobs whose lease has expired (their worker died) are claimed again.
+        With `model_only`, jobs queued without a model name are left alone.
+        """
+        now = time.time()
+        exam_filter = "AND j.exam_id = ?" if exam_id is not None else ""
+        if model_only:
+            exam_filter += " AND j.model_name IS NOT NULL"
+        params = [now, now] + ([exam_id] if exam_id is not None else []) + [limit]
+        conn = self.conn
+        cursor = conn.cursor()
+        # IMMEDIATE takes the write lock up front so two workers can't claim the same job.
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(f"""
+                SELECT {self.GRADING_JOB_COLUMNS}
+                FROM grading_jobs j
+                JOIN students st ON j.student_id = st.id
+                WHERE ((j.status = 'queued' AND j.next_attempt_at <= ?)
+                       OR (j.status = 'running' AND j.lease_until < ?))
+                {exam_filter}
+                ORDER BY j.next_attempt_at, j.id
+                LIMIT ?
+            """, params)
+            jobs = [job[:-1] + (uuid.uuid4().hex,) for job in cursor.fetchall()]
+            cursor.executemany("""
+                UPDATE grading_jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, claim_id = ?, updated_at = ?
                 WHERE id = ?
-            """, (image_path, json.dumps(grades_json), status, existing[0]))
+            """, [(now + lease_seconds, job[13], now, job[0]) for job in jobs])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return jobs
+
+    def complete_grading_jobs(self, results):
+        """
+        Saves (job_id, claim_id, exam_id, student_id, image_path, grades_json, language) results and marks their jobs done,
+        in one transaction. `claim_id` comes from claim_grading_jobs; results for jobs that were
+        re-claimed or re-queued since are dropped. Returns how many results were saved.
+        """
+        now = time.time()
+        with self.transaction():
+            cursor = self.conn.cursor()
+            owned = []
+            for r in results:
+                cursor.execute("""
+                    UPDATE grading_jobs SET status = 'done', last_error = NULL, error_kind = NULL, lease_until = NULL, updated_at = ?
+                    WHERE id = ? AND status = 'running' AND claim_id = ?
+                """, (now, r[0], r[1]))
+                if cursor.rowcount:
+                    owned.append(r[2:])
+            self.save_submissions(owned)
+        return len(owned)
+
+    def fail_grading_job(self, job_id, error, error_kind, retry_at=None, claim_id=None):
+        """
+        Records a failed attempt. With `retry_at` the job is re-queued for that time, otherwise it is marked failed.
+        With `claim_id`, nothing is recorded unless the job is still running under that claim.
+        """
+        now = time.time()
+        query = """
+            UPDATE grading_jobs
+            SET status = ?, last_error = ?, error_kind = ?, next_attempt_at = ?, lease_until = NULL, updated_at = ?
+            WHERE id = ?
+        """
+        params = ["queued" if retry_at is not None else "failed", error, error_kind, retry_at or 0, now, job_id]
+        if claim_id is not None:
+            query += " AND status = 'running' AND claim_id = ?"
+            params.append(claim_id)
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        self._commit()
+        return cursor.rowcount > 0
+
+    def renew_grading_leases(self, claims, lease_seconds=300):
+        """
+        Extends the leases of (job_id, claim_id) claims that are still running, so jobs waiting for a
+        worker thread or the rate limiter are not taken over by another worker.
+        """
+        if not claims:
+            return
+        now = time.time()
+        cursor = self.conn.cursor()
+        cursor.executemany("""
+            UPDATE grading_jobs SET lease_until = ?, updated_at = ?
+            WHERE id = ? AND status = 'running' AND claim_id = ?
+        """, [(now + lease_seconds, now, job_id, claim_id) for job_id, claim_id in claims])
+        self._commit()
+
+    def get_grading_jobs(self, exam_id, status=None):
+        cursor = self.conn.cursor()
+        query = f"SELECT {self.GRADING_JOB_COLUMNS} FROM grading_jobs j JOIN students st ON j.student_id = st.id WHERE j.exam_id = ?"
+        params = [exam_id]
+        if status is not None:
+            query += " AND j.status = ?"
+            params.append(status)
+        cursor.execute(query + " ORDER BY j.id", params)
+        return cursor.fetchall()
+
+    def get_grading_job_counts(self, exam_id=None):
+        """
+        Returns {status: count} of grading jobs, for one exam or overall.
+        """
+        cursor = self.conn.cursor()
+        if exam_id is None:
+            cursor.execute("SELECT status, COUNT(*) FROM grading_jobs GROUP BY status")
         else:
-            cursor.execute("""
-                INSERT INTO submissions (exam_id, student_id, image_path, grades_json, status)
-                VALUES (?, ?, ?, ?, ?)
-            """, (exam_id, student_id, image_path, json.dumps(grades_json), status))
-        self.conn.commit()
+            cursor.execute("SELECT status, COUNT(*) FROM grading_jobs WHERE exam_id = ? GROUP BY status", (exam_id,))
+        return dict(cursor.fetchall())
+
+    def get_next_grading_job_time(self, exam_id=None, model_only=False):
+        """
+        Returns when the next queued or leased job becomes claimable, or None if nothing is pending.
+        """
+        cursor = self.conn.cursor()
+        query = """
+            SELECT MIN(CASE WHEN status = 'queued' THEN next_attempt_at ELSE lease_until END)
+            FROM grading_jobs WHERE status IN ('queued', 'running')
+        """
+        if model_only:
+            query += " AND model_name IS NOT NULL"
+        if exam_id is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query + " AND exam_id = ?", (exam_id,))
+        return cursor.fetchone()[0]
+
+    def get_unassigned_grading_job_count(self):
+        """
+        Counts unfinished jobs queued without a model name (e.g. before schema v5 recorded it).
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM grading_jobs WHERE status IN ('queued', 'running') AND model_name IS NULL")
+        return cursor.fetchone()[0]
+
+    def get_blob_refcounts(self):
+        """
+        Returns {image_path: references} from submissions and unfinished grading jobs, for blob garbage collection.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT image_path, COUNT(*) FROM (
+                SELECT image_path FROM submissions WHERE image_path IS NOT NULL
+                UNION ALL
+                SELECT image_path FROM grading_jobs WHERE status != 'done'
+            ) GROUP BY image_path
+        """)
+        return dict(cursor.fetchall())
 
     def publish_results(self, exam_id):
+        """
+        Publishes an exam's graded results, storing each student's render-ready report card.
+        Returns the ids of the students whose results were published.
+        """
+        now = time.time()
+        exam = self.get_exam_by_id(exam_id)
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT id, student_id, grades_json FROM submissions WHERE exam_id = ? AND grades_json IS NOT NULL", (exam_id,))
+            updates = []
+            student_ids = []
+            for submission_id, student_id, grades_json in cursor.fetchall():
+                grades = _load_grades(grades_json)
+                if grades is None:
+                    continue
+                updates.append((json.dumps(build_report_card(exam[1], exam[2], grades, now)), now, submission_id))
+                student_ids.append(student_id)
+            cursor.executemany("UPDATE submissions SET status = 'Published', report_json = ?, updated_at = ? WHERE id = ?", updates)
+        self.report_cards.invalidate(student_ids)
+        return student_ids
+
+    def get_published_reports(self, student_id):
+        """
+        Returns a student's published report cards (see report_cards.build_report_card), oldest exam
+        first, each with its `study_plan` Markdown once generated. Served from `self.report_cards`;
+        a miss is one indexed query.
+        """
+        return self.report_cards.get(student_id, self._load_published_reports)
+
+    def _load_published_reports(self, student_id):
         cursor = self.conn.cursor()
-        cursor.execute("UPDATE submissions SET status = 'Published' WHERE exam_id = ?", (exam_id,))
-        self.conn.commit()
-        
+        cursor.execute("""
+            SELECT s.report_json, p.plan_markdown FROM submissions s
+            LEFT JOIN study_plans p ON p.plan_key = s.study_plan_key AND p.status = 'ready'
+            WHERE s.student_id = ? AND s.status = 'Published' AND s.report_json IS NOT NULL
+            ORDER BY s.exam_id
+        """, (student_id,))
+        reports = []
+        for report_json, plan_markdown in cursor.fetchall():
+            report = json.loads(report_json)
+            report["study_plan"] = plan_markdown
+            reports.append(report)
+        return reports
+
+    # --- Study Plans ---
+    def assign_study_plans(self, exam_id, default_language="English"):
+        """
+        Links each published submission of an exam to the shared study plan for its concepts to
+        revise and the language it was graded in (`default_language` for submissions graded before
+        that was recorded), creating missing plans as pending. Returns the (plan_key, language,
+        concepts) of plans that still need generating; plans already generated are reused.
+        """
+        now = time.time()
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                SELECT id, student_id, grades_json, COALESCE(language, ?)
+                FROM submissions WHERE exam_id = ? AND status = 'Published'
+            """, (default_language, exam_id))
+            links = []
+            plans = {}
+            student_ids = []
+            for submission_id, student_id, grades_json, language in cursor.fetchall():
+                concepts = plan_concepts(_load_grades(grades_json))
+                plan_key = study_plan_key(concepts, language) if concepts else None
+                if plan_key is not None:
+                    plans[plan_key] = (language, concepts)
+                links.append((plan_key, submission_id))
+                student_ids.append(student_id)
+            cursor.executemany("UPDATE submissions SET study_plan_key = ? WHERE id = ?", links)
+            cursor.executemany("""
+                INSERT OR IGNORE INTO study_plans (plan_key, language, concepts_json, status, created_at, updated_at)
+                VALUES (?, ?, ?, 'pending', ?, ?)
+            """, [(plan_key, language, json.dumps(concepts), now, now) for plan_key, (language, concepts) in plans.items()])
+            missing = []
+            plan_keys = list(plans)
+            for i in range(0, len(plan_keys), 500):
+                chunk = plan_keys[i:i + 500]
+                placeholders = ", ".join("?" for _ in chunk)
+                cursor.execute(f"SELECT plan_key, language, concepts_json FROM study_plans WHERE status != 'ready' AND plan_key IN ({placeholders})", chunk)
+                missing.extend((plan_key, plan_language, json.loads(concepts_json)) for plan_key, plan_language, concepts_json in cursor.fetchall())
+        self.report_cards.invalidate(student_ids)
+        return missing
+
+    def save_study_plan(self, plan_key, plan_markdown):
+        self._finish_study_plan(plan_key, "ready", plan_markdown, None)
+
+    def fail_study_plan(self, plan_key, error):
+        self._finish_study_plan(plan_key, "failed", None, error)
+
+    def _finish_study_plan(self, plan_key, status, plan_markdown, error):
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                UPDATE study_plans SET status = ?, plan_markdown = COALESCE(?, plan_markdown), last_error = ?, updated_at = ?
+                WHERE plan_key = ?
+            """, (status, plan_markdown, error, time.time(), plan_key))
+            cursor.execute("SELECT DISTINCT student_id FROM submissions WHERE study_plan_key = ?", (plan_key,))
+            student_ids = [row[0] for row in cursor.fetchall()]
+        self.report_cards.invalidate(student_ids)
+
+    def get_study_plan_counts(self, exam_id):
+        """
+        Returns {status: number of published submissions} for the study plans linked to an exam.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT p.status, COUNT(*) FROM submissions s
+            JOIN study_plans p ON p.plan_key = s.study_plan_key
+            WHERE s.exam_id = ? GROUP BY p.status
+        """, (exam_id,))
+        return dict(cursor.fetchall())
+
+
     def get_student_results(self, student_id):
         cursor = self.conn.cursor()
         cursor.execute("""
@@ -151,4 +948,4 @@ class DatabaseManager:
         return cursor.fetchall()
 
     def close(self):
-        self.conn.close()
+        self.pool.close_all()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class GradeCache:
+    """
+    Persistent, content-addressed cache of grading results.
+
+    Entries are keyed on a hash of the answer sheet bytes plus everything that influences the
+    model's answer (including the student name it reports), so re-grading the same scan for the
+    same exam settings never hits the network. The cache is bounded by total stored bytes and
+    evicts least recently used entries first.
+
+    Lookups only read. Hit/miss counters and access times are kept in memory and written every
+    `flush_seconds`, so the file shared by the app and worker processes isn't locked on every
+    lookup. Database errors are treated as misses and never fail a grading call.
+    """
+    def __init__(self, db_name="grade_cache.db", max_bytes=50 * 1024 * 1024, flush_seconds=30.0, clock=time.time):
+        self.max_bytes = max_bytes
+        self.flush_seconds = flush_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.pending_stats = {"hits": 0, "misses": 0}
+        self.pending_access = {}  # cache_key -> last access not yet written
+        self.last_flush = clock()
+        self.conn = sqlite3.connect(db_name, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.create_tables()
+
+    def create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_cache (
+            cache_key TEXT PRIMARY KEY,
+            result_json TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_grade_cache_last_access ON grade_cache (last_access)")
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_cache_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO grade_cache_stats (name, value) VALUES ('hits', 0), ('misses', 0)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(image_bytes, question_paper, answer_key, max_marks, strictness, language, student_level, model_name, student_name):
+        """
+        Builds the cache key from the sheet bytes, the exam context it is graded against and the
+        student it is graded for (identical scans of two students must not share a report).
+        """
+        h = hashlib.sha256()
+        h.update(hashlib.sha256(image_bytes).digest())
+        context = [question_paper, answer_key, max_marks, strictness, language, student_level, model_name, student_name]
+        h.update(json.dumps([str(v) for v in context]).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, cache_key):
+        """
+        Returns the cached result dict, or None on a miss (or if the cache can't be read).
+        """
+        with self.lock:
+            try:
+                row = self.conn.execute("SELECT result_json FROM grade_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+                result = json.loads(row[0]) if row else None
+            except (sqlite3.Error, ValueError):
+                result = None
+            if result is not None:
+                self.pending_stats["hits"] += 1
+                self.pending_access[cache_key] = self.clock()
+            else:
+                self.pending_stats["misses"] += 1
+            if self.clock() - self.last_flush >= self.flush_seconds:
+                self._flush()
+        return result
+
+    def put(self, cache_key, result):
+        """
+        Stores a result. A write that fails (e.g. the file is locked) is skipped; the result is just not cached.
+        """
+        result_json = json.dumps(result)
+        size = len(result_json.encode("utf-8"))
+        with self.lock:
+            try:
+                cursor = self.conn.cursor()
+                cursor.execute("""
+                    INSERT OR REPLACE INTO grade_cache (cache_key, result_json, size_bytes, last_access)
+                    VALUES (?, ?, ?, ?)
+                """, (cache_key, result_json, size, self.clock()))
+                self._evict(cursor)
+                self.conn.commit()
+            except sqlite3.Error:
+                self._rollback()
+
+    def _flush(self):
+        # Writes the buffered counters and access times; on failure they stay buffered for the next flush.
+        self.last_flush = self.clock()
+        if not self.pending_access and not any(self.pending_stats.values()):
+            return
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany("UPDATE grade_cache_stats SET value = value + ? WHERE name = ?",
+                               [(count, name) for name, count in self.pending_stats.items()])
+            cursor.executemany("UPDATE grade_cache SET last_access = MAX(last_access, ?) WHERE cache_key = ?",
+                               [(accessed, key) for key, accessed in self.pending_access.items()])
+            self.conn.commit()
+        except sqlite3.Error:
+            self._rollback()
+            return
+        self.pending_stats = {"hits": 0, "misses": 0}
+        self.pending_access = {}
+
+    def _rollback(self):
+        try:
+            self.conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _evict(self, cursor):
+        cursor.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM grade_cache")
+        total = cursor.fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cursor.execute("SELECT cache_key, size_bytes FROM grade_cache ORDER BY last_access ASC")
+        stale = []
+        for cache_key, size in cursor.fetchall():
+            if total <= self.max_bytes:
+                break
+            stale.append((cache_key,))
+            total -= size
+        cursor.executemany("DELETE FROM grade_cache WHERE cache_key = ?", stale)
+
+    def stats(self):
+        """
+        Returns hit/miss counters plus the current entry count and stored bytes.
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT name, value FROM grade_cache_stats")
+            stats = dict(cursor.fetchall())
+            for name, count in self.pending_stats.items():
+                stats[name] = stats.get(name, 0) + count
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM grade_cache")
+            stats["entries"], stats["size_bytes"] = cursor.fetchone()
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM grade_cache")
+            self.conn.execute("UPDATE grade_cache_stats SET value = 0")
+            self.conn.commit()
+            self.pending_stats = {"hits": 0, "misses": 0}
+            self.pending_access = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,319 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import get_metrics
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter that allows at most `requests_per_minute` calls in any 60 second window.
+    Safe to share between worker threads.
+    """
+    def __init__(self, requests_per_minute, window_seconds=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.requests_per_minute = requests_per_minute
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.calls and now - self.calls[0] >= self.window_seconds:
+            self.calls.popleft()
+
+    def available(self):
+        """
+        How many calls could be made right now without waiting (None when unlimited).
+        """
+        if not self.requests_per_minute:
+            return None
+        with self.lock:
+            self._expire(self.clock())
+            return max(self.requests_per_minute - len(self.calls), 0)
+
+    def acquire(self):
+        if not self.requests_per_minute:
+            return
+        while True:
+            with self.lock:
+                now = self.clock()
+                self._expire(now)
+                if len(self.calls) < self.requests_per_minute:
+                    self.calls.append(now)
+                    return
+                wait = self.window_seconds - (now - self.calls[0])
+            self.sleep(max(wait, 0.01))
+
+
+RATE_LIMIT_PATTERN = re.compile(r"\b429\b|resource.?exhausted|quota|rate.?limit|too many requests")
+TRANSIENT_PATTERN = re.compile(r"\b(500|502|503|504)\b|deadline|timed? ?out|unavailable|connection|reset by peer|internal error|temporar|try again|truncated|json|total_score_obtained")
+
+
+def classify_error(error):
+    """
+    Sorts a grading error into "rate_limit", "transient" (worth retrying) or "permanent".
+    Malformed model output counts as transient, since a fresh generation usually parses.
+    """
+    message = str(error).lower()
+    if RATE_LIMIT_PATTERN.search(message):
+        return "rate_limit"
+    if TRANSIENT_PATTERN.search(message):
+        return "transient"
+    return "permanent"
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter. Rate-limit errors back off from a longer base delay.
+    """
+    def __init__(self, max_attempts=5, base_delay=2.0, rate_limit_delay=20.0, max_delay=300.0, rng=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.rate_limit_delay = rate_limit_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+
+    def next_delay(self, attempts, error_kind):
+        """
+        Returns seconds to wait before the next attempt, or None if the job should fail now.
+        """
+        if error_kind == "permanent" or attempts >= self.max_attempts:
+            return None
+        base = self.rate_limit_delay if error_kind == "rate_limit" else self.base_delay
+        cap = min(self.max_delay, base * 2 ** (attempts - 1))
+        return cap / 2 + self.rng.uniform(0, cap / 2)
+
+
+class BatchGrader:
+    """
+    Grades many answer sheets concurrently from the durable `grading_jobs` queue.
+
+    Model calls run on a thread pool bounded by `max_workers` and throttled by a shared
+    RateLimiter. Results are collected on the calling thread as they complete and written in
+    chunks of `flush_every` together with their job state, so the database and the progress
+    callback are never touched concurrently. Failed attempts are retried with backoff according
+    to `retry_policy`; because the queue lives in the database, an interrupted batch picks up
+    where it stopped the next time it is resumed. Each `resume` call is recorded as one batch in
+    `metrics`. Without a default `grader`, jobs queued without a model name are left in the
+    queue rather than claimed.
+
+    No more jobs are claimed than the rate limiter would let through right away, and the leases
+    of in-flight jobs are renewed every `lease_seconds / 3`, so a job waiting for its turn is never
+    taken over by another worker. A result for a job that was taken over anyway is dropped.
+    """
+    def __init__(self, grader, db, max_workers=8, requests_per_minute=60, flush_every=10,
+                 retry_policy=None, lease_seconds=300, poll_interval=1.0, sleep=time.sleep, grader_for_model=None,
+                 pack_size=1, metrics=None):
+        self.grader = grader
+        self.grader_for_model = grader_for_model
+        self.pack_size = max(1, int(pack_size))
+        self.db = db
+        self.max_workers = max(1, int(max_workers))
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.flush_every = max(1, int(flush_every))
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.metrics = metrics or get_metrics()
+
+    @staticmethod
+    def _claim(job):
+        # (job_id, claim_id): re-claiming or re-queueing a job invalidates the claim.
+        return job[0], job[13]
+
+    def _grader(self, job):
+        # Jobs queued for a specific model go to that model's grader when a lookup is configured.
+        if self.grader_for_model is not None and job[12]:
+            return self.grader_for_model(job[12])
+        return self.grader
+
+    def _in_batch(self, batch_id, grade, *args):
+        # Worker threads don't inherit the caller's batch scope, so each task enters it itself.
+        with self.metrics.batch_scope(batch_id):
+            return grade(*args)
+
+    def _grade_one(self, exam, job):
+        with self.metrics.span("rate_limit_wait"):
+            self.rate_limiter.acquire()
+        try:
+            with self.metrics.span("grade_sheet"):
+                return self._grader(job).grade_submission(
+                    job[4],
+                    exam[4],
+                    exam[5],
+                    exam[6],
+                    student_name=job[3],
+                    strictness=job[5] or "Moderate",
+                    language=job[6] or "English"
+                )
+        except Exception as e:
+            return {"error": str(e)}
+
+    def _grade_pack(self, exam, jobs):
+        """
+        Grades a pack of jobs that share an exam, settings and model in one packed call, falling
+        back to one call per sheet when the packed reply fails validation. Returns [(job, result)].
+        """
+        if len(jobs) > 1:
+            with self.metrics.span("rate_limit_wait"):
+                self.rate_limiter.acquire()
+            try:
+                with self.metrics.span("grade_pack"):
+                    results = self._grader(jobs[0]).grade_submissions_packed(
+                        [{"student_id": job[2], "student_name": job[3], "image_path": job[4]} for job in jobs],
+                        exam[4],
+                        exam[5],
+                        exam[6],
+                        strictness=jobs[0][5] or "Moderate",
+                        language=jobs[0][6] or "English"
+                    )
+            except Exception:
+                results = None
+            if results is not None:
+                return [(job, results[job[2]]) for job in jobs]
+        return [(job, self._grade_one(exam, job)) for job in jobs]
+
+    def _make_packs(self, jobs):
+        # Only sheets graded with the same exam, settings and model can share a prompt.
+        groups = {}
+        for job in jobs:
+            groups.setdefault((job[1], job[5], job[6], job[12]), []).append(job)
+        packs = []
+        for group in groups.values():
+            packs.extend(group[i:i + self.pack_size] for i in range(0, len(group), self.pack_size))
+        return packs
+
+    def run(self, exam, tasks, strictness="Moderate", language="English", on_progress=None):
+        """
+        Queues every task for grading, then works through the exam's queue.
+
+        `exam` is an exams row (id, name, subj, cid, qp, key, max) and each task is a dict with
+        `student_id`, `student_name` and `image_path`. See `resume` for the return value.
+        """
+        if tasks:
+            self.db.enqueue_grading_jobs([
+                (exam[0], task["student_id"], task["image_path"], strictness, language, getattr(self.grader, "model_name", None))
+                for task in tasks
+            ])
+        return self.resume(exam[0], on_progress=on_progress)
+
+    def resume(self, exam_id=None, on_progress=None, stop=None):
+        """
+        Grades queued jobs (for one exam, or all exams) until none are left, including retries
+        scheduled along the way and jobs abandoned by an earlier interrupted run. Once `stop` (a
+        threading.Event) is set, no more jobs are claimed: jobs that haven't started are dropped
+        and left to their leases, running calls finish and their results are saved, then it returns.
+
+        `on_progress(done, total, task, result)` is called after every attempt; `task["status"]`
+        is "done", "retrying" or "failed". Returns a summary dict with `graded`, `failed` and
+        `retried` counts, the per-student `errors` of failed jobs and the `batch_id` its metrics
+        were recorded under.
+        """
+        batch_id = self.metrics.new_batch_id()
+        with self.metrics.batch_scope(batch_id, label=f"exam {exam_id}" if exam_id is not None else "all exams"):
+            summary = self._resume(batch_id, exam_id, on_progress, stop)
+        summary["batch_id"] = batch_id
+        return summary
+
+    def _resume(self, batch_id, exam_id, on_progress, stop):
+        counts = self.db.get_grading_job_counts(exam_id)
+        total = counts.get("queued", 0) + counts.get("running", 0)
+        summary = {"graded": 0, "failed": 0, "retried": 0, "errors": {}}
+        exams = {}
+        pending_saves = []
+        done = 0
+        renew_at = time.time() + self.lease_seconds / 3
+        model_only = self.grader is None
+        stopping = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            in_flight = {}
+            try:
+                while True:
+                    if stop is not None and stop.is_set() and not stopping:
+                        stopping = True
+                        for future in list(in_flight):
+                            if future.cancel():
+                                in_flight.pop(future)
+                    free = 0 if stopping else self.max_workers - len(in_flight)
+                    tokens = self.rate_limiter.available()
+                    if tokens is not None:
+                        free = min(free, tokens)
+                    if free > 0:
+                        with self.metrics.span("db_claim"):
+                            claimed = self.db.claim_grading_jobs(free * self.pack_size, exam_id=exam_id, lease_seconds=self.lease_seconds, model_only=model_only)
+                        for pack in self._make_packs(claimed):
+                            exam_ref = pack[0][1]
+                            if exam_ref not in exams:
+                                exams[exam_ref] = self.db.get_exam_by_id(exam_ref)
+                            in_flight[pool.submit(self._in_batch, batch_id, self._grade_pack, exams[exam_ref], pack)] = pack
+
+                    if not in_flight:
+                        self._flush(pending_saves)
+                        if stopping:
+                            break
+                        next_time = self.db.get_next_grading_job_time(exam_id, model_only=model_only)
+                        if next_time is None:
+                            break
+                        self.sleep(min(max(next_time - time.time(), 0.05), self.poll_interval))
+                        continue
+
+                    finished, _ = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    if time.time() >= renew_at:
+                        with self.metrics.span("db_renew"):
+                            self.db.renew_grading_leases(
+                                [self._claim(job) for pack in in_flight.values() for job in pack], self.lease_seconds)
+                        renew_at = time.time() + self.lease_seconds / 3
+                    for future in finished:
+                        in_flight.pop(future)
+                        for job, res in future.result():
+                            task = {"job_id": job[0], "student_id": job[2], "student_name": job[3], "image_path": job[4], "attempts": job[8] + 1}
+                            self.metrics.increment("sheets_graded" if "error" not in res else "failed_attempts")
+                            if "error" not in res:
+                                pending_saves.append(self._claim(job) + (job[1], job[2], job[4], res, job[6] or "English"))
+                                task["status"] = "done"
+                                summary["graded"] += 1
+                                done += 1
+                            else:
+                                task["error_kind"], retrying = self._record_failure(job, task["attempts"], res["error"])
+                                if retrying:
+                                    task["status"] = "retrying"
+                                    summary["retried"] += 1
+                                else:
+                                    task["status"] = "failed"
+                                    summary["failed"] += 1
+                                    summary["errors"][job[2]] = res["error"]
+                                    done += 1
+                            if len(pending_saves) >= self.flush_every:
+                                self._flush(pending_saves)
+                            if on_progress:
+                                on_progress(done, max(total, done, 1), task, res)
+            finally:
+                self._flush(pending_saves)
+        return summary
+
+    def _record_failure(self, job, attempts, error):
+        # Returns (error_kind, retrying): whether the job was re-queued or failed for good.
+        kind = classify_error(error)
+        delay = self.retry_policy.next_delay(attempts, kind)
+        job_id, claim_id = self._claim(job)
+        if delay is None:
+            self.db.fail_grading_job(job_id, error, kind, claim_id=claim_id)
+            return kind, False
+        self.db.fail_grading_job(job_id, error, kind, retry_at=time.time() + delay, claim_id=claim_id)
+        return kind, True
+
+    def _flush(self, pending_saves):
+        # One transaction per chunk of results instead of one commit per student.
+        if pending_saves:
+            with self.metrics.span("db_write"):
+                saved = self.db.complete_grading_jobs(pending_saves)
+            self.metrics.observe("db_write_rows", saved)
+            if saved < len(pending_saves):
+                self.metrics.increment("stale_results", len(pending_saves) - saved)
+            pending_saves.clear()
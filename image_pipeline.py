@@ -0,0 +1,140 @@
+import io
+from PIL import Image, ImageOps
+
+
+class PreparedImage:
+    """
+    An answer sheet encoded for upload, plus the sizes needed to report savings.
+    """
+    def __init__(self, data, mime_type, width, height, original_bytes):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.original_bytes = original_bytes
+
+    @property
+    def size_bytes(self):
+        return len(self.data)
+
+    def as_part(self):
+        """
+        Returns the inline blob form accepted by `GenerativeModel.generate_content`.
+        """
+        return {"mime_type": self.mime_type, "data": self.data}
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable read-only file over an existing buffer (e.g. an upload's memoryview), without copying it first.
+    """
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast("B")
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), self.view.nbytes - self.pos))
+        b[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.view.nbytes
+        self.pos = max(0, offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class ImagePipeline:
+    """
+    Shrinks phone photos of answer sheets before they are sent to the model.
+
+    Applies EXIF rotation, optional grayscale conversion and contrast normalisation, then
+    downscales to `max_side` pixels and re-encodes, lowering quality (and finally resolution)
+    until the result fits in `max_bytes`.
+    """
+    MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+    def __init__(self, max_side=1600, max_bytes=400 * 1024, image_format="JPEG", grayscale=True,
+                 autocontrast_cutoff=1, qualities=(85, 75, 65, 55, 45), min_side=800):
+        if image_format not in self.MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.image_format = image_format
+        self.grayscale = grayscale
+        self.autocontrast_cutoff = autocontrast_cutoff
+        self.qualities = qualities
+        self.min_side = min_side
+
+    def normalise(self, img):
+        img = ImageOps.exif_transpose(img)
+        if self.grayscale:
+            img = img.convert("L")
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if self.autocontrast_cutoff is not None:
+            img = ImageOps.autocontrast(img, cutoff=self.autocontrast_cutoff)
+        if max(img.size) > self.max_side:
+            img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+        return img
+
+    def encode(self, img, quality):
+        buf = io.BytesIO()
+        if self.image_format == "JPEG":
+            img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            img.save(buf, format="WEBP", quality=quality, method=4)
+        return buf.getvalue()
+
+    def fit_to_budget(self, img):
+        data = None
+        while True:
+            for quality in self.qualities:
+                data = self.encode(img, quality)
+                if len(data) <= self.max_bytes:
+                    return img, data
+            if max(img.size) <= self.min_side:
+                return img, data
+            w, h = img.size
+            img = img.resize((max(1, int(w * 0.8)), max(1, int(h * 0.8))), Image.LANCZOS)
+
+    def process(self, source):
+        """
+        Prepares an image from a path, a file-like object, raw bytes or a buffer such as a memoryview.
+        Buffers are decoded in place rather than copied.
+        """
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                raw = f.read()
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            raw = source
+        else:
+            raw = source.read()
+        fp = io.BytesIO(raw) if isinstance(raw, bytes) else BufferReader(raw)
+        with Image.open(fp) as img:
+            if img.format == "JPEG":
+                # Let libjpeg decode at a reduced scale instead of materialising every pixel.
+                img.draft("L" if self.grayscale else "RGB", (self.max_side, self.max_side))
+            img.load()
+            return self.prepare(img, memoryview(raw).nbytes)
+
+    def prepare(self, img, original_bytes=None):
+        """
+        Prepares an already decoded PIL image, e.g. a rendered PDF page.
+        """
+        if original_bytes is None:
+            original_bytes = img.width * img.height * len(img.getbands())
+        prepared, data = self.fit_to_budget(self.normalise(img))
+        return PreparedImage(data, self.MIME_TYPES[self.image_format], prepared.width, prepared.height, original_bytes)
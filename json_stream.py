@@ -0,0 +1,153 @@
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _json_start(text):
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return min(starts) if starts else -1
+
+
+def close_partial_json(text):
+    """
+    Best-effort parse of a JSON document that may be cut off mid-stream.
+
+    Open strings, arrays and objects are closed; if that is not enough, the text is cut back to the
+    last complete member. Returns the parsed value, or None if nothing usable has arrived yet.
+    """
+    start = _json_start(text)
+    if start == -1:
+        return None
+    text = text[start:]
+
+    stack = []
+    in_string = False
+    escaped = False
+    cut_points = []  # (index, stack snapshot) where the text can be truncated and closed
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+            cut_points.append((i + 1, tuple(stack)))
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return _loads(text[:i + 1])
+        elif ch == ",":
+            cut_points.append((i, tuple(stack)))
+
+    tail = text.rstrip()
+    if in_string:
+        tail = (tail[:-1] if escaped else tail) + '"'
+    candidate = _close(tail, stack)
+    value = _loads(candidate)
+    if value is not None:
+        return value
+    for index, snapshot in reversed(cut_points[-50:]):
+        value = _loads(_close(text[:index], list(snapshot)))
+        if value is not None:
+            return value
+    return None
+
+
+def _close(text, stack):
+    text = text.rstrip()
+    if text.endswith(":"):
+        text += " null"
+    text = text.rstrip(",")
+    return text + "".join(_CLOSERS[ch] for ch in reversed(stack))
+
+
+def _loads(text):
+    try:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", text))
+    except ValueError:
+        return None
+
+
+def _document_end(text, start):
+    # Index just past the value that opens at `start`, or None if it never closes.
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def extract_json(text):
+    """
+    Extracts the JSON value from a complete model reply.
+
+    Tolerates code fences and prose around the JSON and trailing commas, but not a reply cut off
+    before the document ends (use close_partial_json for previews). Raises ValueError if no complete
+    JSON value can be parsed.
+    """
+    start = _json_start(text)
+    if start == -1:
+        raise ValueError("No JSON object found in model response")
+    try:
+        return _decoder.raw_decode(text, start)[0]
+    except ValueError:
+        pass
+    end = _document_end(text, start)
+    if end is None:
+        raise ValueError("Model response was truncated before the JSON document ended")
+    value = _loads(text[start:end])
+    if value is None:
+        raise ValueError("Could not parse JSON from model response")
+    return value
+
+
+class IncrementalJSONParser:
+    """
+    Accumulates streamed text and exposes the best-effort parse of what has arrived so far.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.partial = None
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def feed(self, chunk):
+        """
+        Adds a chunk and returns the updated partial value, or None if it did not change.
+        """
+        if not chunk:
+            return None
+        self.chunks.append(chunk)
+        value = close_partial_json(self.text)
+        if value is None or value == self.partial:
+            return None
+        self.partial = value
+        return value
@@ -0,0 +1,220 @@
+import contextvars
+import csv
+import io
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+_current_batch = contextvars.ContextVar("metrics_batch", default=None)
+
+SUMMARY_FIELDS = ("metric", "count", "sum", "mean", "min", "p50", "p95", "max")
+
+
+class Histogram:
+    """
+    Power-of-two buckets plus a bounded sample of recent values for percentiles.
+    Works for any unit (milliseconds, bytes, tokens).
+    """
+    def __init__(self, sample_size=2048):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}  # upper bound -> count
+        self.samples = deque(maxlen=sample_size)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        bound = 2 ** math.ceil(math.log2(value)) if value > 1 else 1
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+        self.samples.append(value)
+
+    def percentile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": _round(self.total),
+            "mean": _round(self.total / self.count) if self.count else None,
+            "min": _round(self.min),
+            "p50": _round(self.percentile(50)),
+            "p95": _round(self.percentile(95)),
+            "max": _round(self.max),
+            "buckets": dict(sorted(self.buckets.items())),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+class BatchMetrics:
+    def __init__(self, batch_id, label=None):
+        self.batch_id = batch_id
+        self.label = label
+        self.started_at = time.time()
+        self.histograms = {}
+        self.counters = {}
+
+
+class MetricsRegistry:
+    """
+    In-process registry of grading metrics.
+
+    Durations are recorded in milliseconds under the stage name (e.g. "model_call"), sizes and
+    token counts under their own names. Every observation goes into the running totals and, when
+    made inside `batch_scope`, into that batch's own histograms so a batch can be exported on
+    its own. The last `max_batches` batches are kept.
+    """
+    TOTALS = "all"
+
+    def __init__(self, max_batches=20):
+        self.max_batches = max_batches
+        self.lock = threading.Lock()
+        self.batches = OrderedDict()
+        self.totals = BatchMetrics(self.TOTALS)
+
+    def new_batch_id(self):
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+    @contextmanager
+    def batch_scope(self, batch_id, label=None):
+        """
+        Attributes observations made in this context (this thread) to `batch_id`.
+        """
+        with self.lock:
+            if batch_id not in self.batches:
+                self.batches[batch_id] = BatchMetrics(batch_id, label)
+                while len(self.batches) > self.max_batches:
+                    self.batches.popitem(last=False)
+        token = _current_batch.set(batch_id)
+        try:
+            yield batch_id
+        finally:
+            _current_batch.reset(token)
+
+    def _targets(self):
+        batch = self.batches.get(_current_batch.get())
+        return (self.totals, batch) if batch is not None else (self.totals,)
+
+    def observe(self, name, value):
+        if value is None:
+            return
+        with self.lock:
+            for target in self._targets():
+                histogram = target.histograms.get(name)
+                if histogram is None:
+                    histogram = target.histograms[name] = Histogram()
+                histogram.observe(float(value))
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            for target in self._targets():
+                target.counters[name] = target.counters.get(name, 0) + amount
+
+    @contextmanager
+    def span(self, name):
+        """
+        Times the block and records its duration in milliseconds, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def batch_ids(self):
+        with self.lock:
+            return list(reversed(self.batches))
+
+    def snapshot(self, batch_id=None):
+        """
+        Returns a JSON-ready dict of counters and histogram summaries for one batch, or for the
+        running totals when `batch_id` is None. Returns None for an unknown batch.
+        """
+        with self.lock:
+            target = self.totals if batch_id is None else self.batches.get(batch_id)
+            if target is None:
+                return None
+            return {
+                "batch_id": target.batch_id,
+                "label": target.label,
+                "started_at": target.started_at,
+                "counters": dict(target.counters),
+                "metrics": {name: h.summary() for name, h in sorted(target.histograms.items())},
+            }
+
+    def to_json(self, batch_id=None):
+        return json.dumps(self.snapshot(batch_id), indent=2)
+
+    def to_csv(self, batch_id=None):
+        """
+        One row per metric with count, sum, mean, min, p50, p95 and max; counters follow with only a count.
+        """
+        snapshot = self.snapshot(batch_id) or {"metrics": {}, "counters": {}}
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(SUMMARY_FIELDS)
+        for name, summary in snapshot["metrics"].items():
+            writer.writerow([name] + [summary[field] for field in SUMMARY_FIELDS[1:]])
+        for name, count in snapshot["counters"].items():
+            writer.writerow([name, count] + [""] * (len(SUMMARY_FIELDS) - 2))
+        return out.getvalue()
+
+    def reset(self):
+        with self.lock:
+            self.batches.clear()
+            self.totals = BatchMetrics(self.TOTALS)
+
+
+def usage_counts(response):
+    """
+    Returns (prompt_tokens, output_tokens, total_tokens) from a response's usage metadata, with None for anything missing.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None, None
+    return (
+        getattr(usage, "prompt_token_count", None),
+        getattr(usage, "candidates_token_count", None),
+        getattr(usage, "total_token_count", None),
+    )
+
+
+def payload_bytes(contents):
+    """
+    Approximate request size: UTF-8 text plus inline image data.
+    """
+    size = 0
+    for part in contents:
+        if isinstance(part, str):
+            size += len(part.encode("utf-8"))
+        elif isinstance(part, dict):
+            size += len(part.get("data", b""))
+    return size
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the process-wide MetricsRegistry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+    return _registry
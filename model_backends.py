@@ -0,0 +1,170 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+
+class GeminiBackend:
+    """
+    Google Gemini via `google.generativeai`. The SDK is imported on first use.
+    """
+    def __init__(self, api_key, model_name):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, contents, **kwargs):
+        return self.model.generate_content(contents, **kwargs)
+
+    @staticmethod
+    def list_models(api_key):
+        """
+        Lists Gemini models that support content generation. Raises on network or auth errors.
+        """
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        models = []
+        for m in genai.list_models():
+            if 'generateContent' in m.supported_generation_methods:
+                models.append(m.name)
+        models.sort(reverse=True)
+        return models
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """
+    Mimics a generate_content response: `.text`, `.usage_metadata`, and iteration over chunks when streamed.
+    """
+    def __init__(self, text, usage_metadata, chunk_size=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        size = self.chunk_size or len(self.text) or 1
+        for i in range(0, len(self.text), size):
+            yield FakeChunk(self.text[i:i + size])
+
+
+class FakeBackend:
+    """
+    Deterministic offline stand-in for a model backend, for tests and benchmarks.
+
+    Latency is drawn from a log-normal distribution (`latency_median` seconds, spread `latency_sigma`),
+    a fraction `error_rate` of calls fail with errors cycling through `error_messages`, and replies
+    contain `questions` graded questions with feedback of `feedback_chars` characters. Every draw is
+    seeded from `seed`, the request text and how often that request was seen before, so results do not
+    depend on thread scheduling.
+    """
+    STUDENT_NAME = re.compile(r"\*\*Student Name:\*\* (.+?) \(")
+    SHEET_HEADER = re.compile(r"=== SHEET \d+: student_id=(.+?), student_name=(.+?) ===")
+    ERROR_MESSAGES = (
+        "429 Resource has been exhausted (e.g. check quota).",
+        "503 The service is currently unavailable.",
+        "504 Deadline Exceeded",
+    )
+
+    def __init__(self, model_name="models/fake-grader", latency_median=0.0, latency_sigma=0.0, error_rate=0.0,
+                 questions=5, feedback_chars=200, max_marks=None, seed=0, error_messages=None,
+                 sleep=time.sleep, stream_chunk_chars=64):
+        self.model_name = model_name
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.questions = questions
+        self.feedback_chars = feedback_chars
+        self.max_marks = max_marks
+        self.seed = seed
+        self.error_messages = tuple(error_messages or self.ERROR_MESSAGES)
+        self.sleep = sleep
+        self.stream_chunk_chars = stream_chunk_chars
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.calls = 0
+        self.latencies = []
+
+    def _rng(self, request_text):
+        digest = hashlib.sha256(request_text.encode("utf-8")).hexdigest()
+        with self.lock:
+            attempt = self.seen.get(digest, 0)
+            self.seen[digest] = attempt + 1
+            self.calls += 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        if not isinstance(contents, list):
+            contents = [contents]
+        texts = [part for part in contents if isinstance(part, str)]
+        request_text = "\n".join(texts)
+        rng = self._rng(request_text)
+
+        latency = self.latency_median * rng.lognormvariate(0, self.latency_sigma) if self.latency_median else 0.0
+        with self.lock:
+            self.latencies.append(latency)
+        if latency:
+            self.sleep(latency)
+        if rng.random() < self.error_rate:
+            raise RuntimeError(self.error_messages[rng.randrange(len(self.error_messages))])
+
+        sheets = self.SHEET_HEADER.findall(request_text)
+        if sheets:
+            payload = [dict(self._result(rng, name), student_id=student_id) for student_id, name in sheets]
+        else:
+            match = self.STUDENT_NAME.search(request_text)
+            payload = self._result(rng, match.group(1) if match else "Student")
+        text = json.dumps(payload)
+        if generation_config is None:
+            text = f"```json\n{text}\n```"
+        prompt_bytes = sum(len(t) for t in texts) + sum(len(p.get("data", b"")) for p in contents if isinstance(p, dict))
+        usage = FakeUsage(prompt_bytes // 4, len(text) // 4)
+        return FakeResponse(text, usage, chunk_size=self.stream_chunk_chars if stream else None)
+
+    def _result(self, rng, student_name):
+        per_question = 5
+        breakdown = []
+        for n in range(1, self.questions + 1):
+            marks = rng.randint(0, per_question)
+            breakdown.append({
+                "question_number": str(n),
+                "marks_obtained": float(marks),
+                "max_marks": float(per_question),
+                "feedback": self._text(rng, self.feedback_chars),
+                "status": "Correct" if marks == per_question else "Partially Correct" if marks else "Incorrect",
+            })
+        concepts = ["Fractions", "Photosynthesis", "Newton's Laws", "Grammar", "Map Reading", "Algebra"]
+        return {
+            "student_name": student_name,
+            "total_score_obtained": sum(q["marks_obtained"] for q in breakdown),
+            "max_score": self.max_marks or per_question * self.questions,
+            "question_wise_breakdown": breakdown,
+            "overall_feedback": self._text(rng, self.feedback_chars),
+            "improvement_pointers": [self._text(rng, 60) for _ in range(2)],
+            "concepts_to_revise": rng.sample(concepts, 2),
+            "real_world_connections": self._text(rng, self.feedback_chars),
+        }
+
+    @staticmethod
+    def _text(rng, length):
+        words = ("good", "answer", "explain", "step", "method", "correct", "revise", "concept", "clear", "units")
+        out = []
+        size = 0
+        while size < length:
+            word = words[rng.randrange(len(words))]
+            out.append(word)
+            size += len(word) + 1
+        return " ".join(out)[:length]
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class StaticModelSource:
+    """
+    Offline stand-in for the Gemini model listing. Returns `models`, or raises `error` if set.
+    """
+    def __init__(self, models=None, error=None):
+        self.models = list(models or [])
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, api_key):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return list(self.models)
+
+
+def gemini_model_source(api_key):
+    from ai_engine import AIGrader
+    return AIGrader.fetch_models(api_key)
+
+
+class ModelCatalog:
+    """
+    Caches the list of available models per API key.
+
+    Fresh entries are served from memory. Stale entries, and entries loaded from the on-disk
+    snapshot on a cold start, are returned immediately while a background thread refreshes them.
+    If a refresh fails, the last good list keeps being served.
+    """
+    def __init__(self, source=None, ttl_seconds=600, snapshot_path="model_catalog.json", clock=time.time):
+        self.source = source or gemini_model_source
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_path = snapshot_path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}  # key hash -> (models, fetched_at)
+        self.refreshing = set()
+        self.last_error = None
+        self._load_snapshot()
+
+    @staticmethod
+    def _key(api_key):
+        # The snapshot is written to disk, so never store the key itself.
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in data.items():
+                self.entries[key] = (entry["models"], entry["fetched_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.entries = {}
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self.lock:
+            data = {k: {"models": m, "fetched_at": t} for k, (m, t) in self.entries.items()}
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError:
+            pass
+
+    def refresh(self, api_key):
+        """
+        Fetches the model list synchronously. Returns the new list, or the last good one on failure.
+        """
+        key = self._key(api_key)
+        try:
+            models = sorted(self.source(api_key), reverse=True)
+        except Exception as e:
+            self.last_error = str(e)
+            with self.lock:
+                entry = self.entries.get(key)
+            return entry[0] if entry else []
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+        # An empty listing is treated like a failure so it never replaces a good snapshot.
+        if not models:
+            with self.lock:
+                entry = self.entries.get(key)
+            return entry[0] if entry else []
+        with self.lock:
+            self.entries[key] = (models, self.clock())
+        self.last_error = None
+        self._save_snapshot()
+        return models
+
+    def refresh_in_background(self, api_key):
+        key = self._key(api_key)
+        with self.lock:
+            if key in self.refreshing:
+                return None
+            self.refreshing.add(key)
+        thread = threading.Thread(target=self.refresh, args=(api_key,), daemon=True)
+        thread.start()
+        return thread
+
+    def get_models(self, api_key):
+        """
+        Returns the cached model list for `api_key`, fetching synchronously only when nothing is cached.
+        """
+        key = self._key(api_key)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            with self.lock:
+                self.refreshing.add(key)
+            return self.refresh(api_key)
+        models, fetched_at = entry
+        if self.clock() - fetched_at >= self.ttl_seconds:
+            self.refresh_in_background(api_key)
+        return models
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_model_catalog():
+    """
+    Returns the process-wide ModelCatalog.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog()
+    return _catalog
@@ -0,0 +1,69 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from image_pipeline import ImagePipeline
+
+PDF_MAGIC = b"%PDF"
+
+
+def is_pdf(data):
+    return bytes(data[:4]) == PDF_MAGIC
+
+
+def count_pages(pdf_path):
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def render_page_image(pdf_path, page_number, dpi=150, grayscale=False):
+    """
+    Rasterises a single page to a PIL image. The caller closes it.
+    """
+    return convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number, grayscale=grayscale)[0]
+
+
+def render_page(pdf_path, page_number, pipeline, dpi=150, on_render=None):
+    """
+    Rasterises a single page and immediately shrinks it, so only the compact encoding outlives this call.
+    `on_render(page_number, image)` may look at the full-size image before it is closed.
+    """
+    page = render_page_image(pdf_path, page_number, dpi=dpi, grayscale=pipeline.grayscale)
+    try:
+        if on_render is not None:
+            on_render(page_number, page)
+        return pipeline.prepare(page)
+    finally:
+        page.close()
+
+
+def iter_pdf_pages(pdf_path, pipeline=None, dpi=150, max_workers=None, on_render=None):
+    """
+    Yields a PreparedImage per page, in page order.
+
+    Pages are rendered by `pdftoppm` subprocesses on up to `max_workers` threads (one per core by
+    default). At most `max_workers` pages are in flight, so a long booklet never sits fully
+    decoded in memory. `on_render` is passed to `render_page` and runs on the worker threads.
+    """
+    pipeline = pipeline or ImagePipeline()
+    total = count_pages(pdf_path)
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, total))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        next_page = 1
+        while next_page <= total or pending:
+            while next_page <= total and len(pending) < max_workers:
+                pending.append(pool.submit(render_page, pdf_path, next_page, pipeline, dpi, on_render))
+                next_page += 1
+            yield pending.popleft().result()
+
+
+def prepare_sheet(path, data, pipeline=None, dpi=150):
+    """
+    Returns the PreparedImage pages of an uploaded answer sheet: every page of a PDF, or the single image.
+    """
+    pipeline = pipeline or ImagePipeline()
+    if is_pdf(data):
+        return list(iter_pdf_pages(path, pipeline=pipeline, dpi=dpi))
+    return [pipeline.process(data)]
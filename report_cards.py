@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def build_report_card(exam_name, subject, grades, published_at=None):
+    """
+    Render-ready report card for the Parent Dashboard, built once when results are published.
+    """
+    return {
+        "exam_name": exam_name,
+        "subject": subject,
+        "score": f"{grades.get('total_score_obtained')} / {grades.get('max_score')}",
+        "overall_feedback": grades.get("overall_feedback"),
+        "real_world_connections": grades.get("real_world_connections", "Not available"),
+        "improvement_pointers": list(grades.get("improvement_pointers") or []),
+        "published_at": published_at,
+    }
+
+
+class ReportCardCache:
+    """
+    Read-through cache of each student's published report cards.
+
+    DatabaseManager invalidates a student whenever their results are published or regraded. Entries
+    also expire after `ttl_seconds`, which bounds staleness when another process (e.g. the grading
+    worker) writes to the same database.
+    """
+    def __init__(self, max_entries=5000, ttl_seconds=60, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # student_id -> (report cards, expires_at)
+        self.generation = 0  # bumped on every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, student_id, load):
+        """
+        Returns the cached report cards for `student_id`, calling `load(student_id)` on a miss.
+        """
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(student_id)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(student_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self.generation
+        reports = load(student_id)
+        with self.lock:
+            # Don't cache a load that raced with an invalidation; the next read reloads.
+            if generation != self.generation:
+                return reports
+            self.entries[student_id] = (reports, now + self.ttl_seconds)
+            self.entries.move_to_end(student_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return reports
+
+    def invalidate(self, student_ids=None):
+        with self.lock:
+            self.generation += 1
+            if student_ids is None:
+                self.entries.clear()
+                return
+            for student_id in student_ids:
+                self.entries.pop(student_id, None)
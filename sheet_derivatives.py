@@ -0,0 +1,135 @@
+import hashlib
+import io
+import os
+
+from PIL import Image, ImageOps
+
+from image_pipeline import BufferReader, ImagePipeline, PreparedImage
+from pdf_ingest import is_pdf, iter_pdf_pages
+
+
+class SheetDerivatives:
+    """
+    Thumbnail, preview and model-ready images of stored answer sheets.
+
+    They are generated once, when a sheet is saved, from a single decode of each page and kept
+    next to its blob under the same content hash:
+
+        <sha256>.thumb.jpg             small image for the roster
+        <sha256>.preview.jpg           medium image for report cards
+        <sha256>.model-<tag>-<n>.<ext> page n as prepared by an ImagePipeline (tag = its settings)
+
+    Views and grading read these files instead of decoding the original photo again.
+    """
+    EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+    def __init__(self, store, pipeline=None, thumbnail_side=240, preview_side=1024, dpi=150):
+        self.store = store
+        self.pipeline = pipeline or ImagePipeline()
+        self.thumbnail_side = thumbnail_side
+        self.preview_side = preview_side
+        self.dpi = dpi
+
+    @staticmethod
+    def pipeline_tag(pipeline):
+        settings = (pipeline.max_side, pipeline.max_bytes, pipeline.image_format, pipeline.grayscale,
+                    pipeline.autocontrast_cutoff, tuple(pipeline.qualities), pipeline.min_side)
+        return hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()[:10]
+
+    def _path(self, digest, suffix):
+        return f"{self.store.path(digest)}.{suffix}"
+
+    def _model_path(self, digest, pipeline, page):
+        return self._path(digest, f"model-{self.pipeline_tag(pipeline)}-{page}.{self.EXTENSIONS[pipeline.image_format]}")
+
+    def thumbnail_path(self, sheet_path):
+        return self._existing(sheet_path, "thumb.jpg")
+
+    def preview_path(self, sheet_path):
+        return self._existing(sheet_path, "preview.jpg")
+
+    def _existing(self, sheet_path, suffix):
+        digest = self.store.digest_of(sheet_path)
+        if digest is None:
+            return None
+        path = self._path(digest, suffix)
+        return path if os.path.exists(path) else None
+
+    def generate(self, sheet_path, data=None):
+        """
+        Writes the derivatives of a stored sheet unless they already exist. `data` may be the
+        upload's buffer, which saves reading the blob back. Returns False for sheets outside the store.
+        """
+        digest = self.store.digest_of(sheet_path)
+        if digest is None:
+            return False
+        if os.path.exists(self._path(digest, "thumb.jpg")):
+            return True
+        if data is None:
+            with open(sheet_path, "rb") as f:
+                data = f.read()
+        original_bytes = memoryview(data).nbytes
+
+        if is_pdf(data):
+            # Pages are rendered and shrunk one at a time on the bounded pool; only a
+            # preview-sized copy of page 1 is kept.
+            first = []
+
+            def keep_first(page_number, page):
+                if page_number == 1:
+                    first.append(self._preview(page))
+
+            pages = iter_pdf_pages(sheet_path, pipeline=self.pipeline, dpi=self.dpi, on_render=keep_first)
+            for n, prepared in enumerate(pages):
+                self.store.write_file(self._model_path(digest, self.pipeline, n), prepared.data)
+            preview = first[0]
+        else:
+            with Image.open(BufferReader(data)) as img:
+                if img.format == "JPEG":
+                    img.draft("RGB", (self.pipeline.max_side, self.pipeline.max_side))
+                img.load()
+                page = ImageOps.exif_transpose(img)
+            try:
+                prepared = self.pipeline.prepare(page, original_bytes)
+                self.store.write_file(self._model_path(digest, self.pipeline, 0), prepared.data)
+                preview = self._preview(page)
+            finally:
+                page.close()
+        self.store.write_file(self._path(digest, "preview.jpg"), self._encode(preview, 80))
+        preview.thumbnail((self.thumbnail_side, self.thumbnail_side), Image.LANCZOS)
+        # The thumbnail is written last, so it marks a complete set.
+        self.store.write_file(self._path(digest, "thumb.jpg"), self._encode(preview, 70))
+        return True
+
+    def _preview(self, page):
+        preview = page.convert("RGB")
+        preview.thumbnail((self.preview_side, self.preview_side), Image.LANCZOS)
+        return preview
+
+    @staticmethod
+    def _encode(img, quality):
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+        return buf.getvalue()
+
+    def model_pages(self, sheet_path, pipeline):
+        """
+        Returns the stored PreparedImage pages of a sheet for `pipeline`, or None if they weren't generated with the same settings.
+        """
+        digest = self.store.digest_of(sheet_path)
+        if digest is None or not os.path.exists(self._path(digest, "thumb.jpg")):
+            return None
+        mime_type = ImagePipeline.MIME_TYPES[pipeline.image_format]
+        original_bytes = os.path.getsize(sheet_path) if os.path.exists(sheet_path) else None
+        pages = []
+        while True:
+            path = self._model_path(digest, pipeline, len(pages))
+            if not os.path.exists(path):
+                break
+            with open(path, "rb") as f:
+                data = f.read()
+            # Only the header is parsed for the size; the pixels are not decoded.
+            with Image.open(io.BytesIO(data)) as img:
+                width, height = img.size
+            pages.append(PreparedImage(data, mime_type, width, height, original_bytes))
+        return pages or None
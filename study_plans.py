@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from grading_engine import RateLimiter
+
+
+class StudyPlanGenerator:
+    """
+    Generates study plans in the background on at most `max_workers` threads.
+
+    A plan key is never generated twice at once. Plans are written back through `db`
+    (save_study_plan / fail_study_plan); failed plans are retried the next time they are submitted.
+    """
+    def __init__(self, db, max_workers=4, requests_per_minute=60):
+        self.db = db
+        self.pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="study-plans")
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.lock = threading.Lock()
+        self.in_flight = set()
+
+    def submit(self, grader, plans):
+        """
+        Queues (plan_key, language, concepts) tuples for generation with `grader`. Returns how many were queued.
+        """
+        queued = 0
+        for plan_key, language, concepts in plans:
+            with self.lock:
+                if plan_key in self.in_flight:
+                    continue
+                self.in_flight.add(plan_key)
+            self.pool.submit(self._generate, grader, plan_key, language, concepts)
+            queued += 1
+        return queued
+
+    def _generate(self, grader, plan_key, language, concepts):
+        try:
+            self.rate_limiter.acquire()
+            self.db.save_study_plan(plan_key, grader.generate_study_plan(concepts, language))
+        except Exception as e:
+            self.db.fail_study_plan(plan_key, str(e))
+        finally:
+            with self.lock:
+                self.in_flight.discard(plan_key)
+
+    def pending(self):
+        with self.lock:
+            return len(self.in_flight)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
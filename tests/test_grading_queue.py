@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from database import DatabaseManager
+
+
+class RequeueReclaimTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.tmp, "grades.db"))
+        class_id = self.db.create_class("5A", "5")
+        self.db.add_student("Asha", "1", class_id)
+        self.student_id = self.db.conn.execute("SELECT id FROM students").fetchone()[0]
+        self.exam_id = self.db.create_exam("Unit Test", "Science", class_id, "Q", "K", 10)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp)
+
+    def enqueue(self, image_path):
+        self.db.enqueue_grading_jobs([(self.exam_id, self.student_id, image_path, "Moderate", "English", "models/fake")])
+
+    def test_stale_claim_is_dropped_after_requeue(self):
+        self.enqueue("old.jpg")
+        (stale,) = self.db.claim_grading_jobs(1, lease_seconds=300)
+        # The teacher re-uploads; the job is re-queued and another worker claims the new sheet.
+        self.enqueue("new.jpg")
+        (current,) = self.db.claim_grading_jobs(1, lease_seconds=300)
+        self.assertEqual(stale[8], current[8])  # attempt counts repeat after a re-queue
+        self.assertNotEqual(stale[13], current[13])
+
+        grades = {"total_score_obtained": 5, "max_score": 10, "question_wise_breakdown": []}
+        self.assertEqual(self.db.complete_grading_jobs([(stale[0], stale[13], self.exam_id, self.student_id, stale[4], grades, "English")]), 0)
+        self.assertFalse(self.db.fail_grading_job(stale[0], "late", "transient", claim_id=stale[13]))
+        self.assertEqual(self.db.complete_grading_jobs([(current[0], current[13], self.exam_id, self.student_id, current[4], grades, "English")]), 1)
+
+        self.assertEqual(self.db.get_submission(self.exam_id, self.student_id)[3], "new.jpg")
+        self.assertEqual(self.db.get_grading_job_counts(self.exam_id), {"done": 1})
+
+    def test_renewal_only_extends_the_current_claim(self):
+        self.enqueue("old.jpg")
+        (stale,) = self.db.claim_grading_jobs(1, lease_seconds=0)
+        (current,) = self.db.claim_grading_jobs(1, lease_seconds=0)  # lease expired, taken over
+        self.db.renew_grading_leases([(stale[0], stale[13])], lease_seconds=300)
+        # Renewing the stale claim didn't extend the lease, so the job can still be taken over.
+        (latest,) = self.db.claim_grading_jobs(1, lease_seconds=0)
+        self.assertNotEqual(latest[13], current[13])
+        self.db.renew_grading_leases([(latest[0], latest[13])], lease_seconds=300)
+        self.assertEqual(self.db.claim_grading_jobs(1), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
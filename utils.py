@@ -1,15 +1,16 @@
 import os
 from PIL import Image
 import io
+import csv
+from blob_store import BlobStore
 
-def save_uploaded_file(uploaded_file):
+def save_uploaded_file(uploaded_file, store=None):
+    """
+    Saves an upload into the content-addressed blob store and returns its path.
+    Identical uploads share one file; the upload's buffer is hashed and written without copying it.
+    """
     try:
-        if not os.path.exists("temp"):
-            os.makedirs("temp")
-        file_path = os.path.join("temp", uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return file_path
+        return (store or BlobStore()).put(uploaded_file.getbuffer())
     except Exception as e:
         return None
 
@@ -17,3 +18,34 @@ def cleanup_temp_files():
     if os.path.exists("temp"):
         for file in os.listdir("temp"):
             os.remove(os.path.join("temp", file))
+
+ROSTER_NAME_COLUMNS = ("name", "student name", "student")
+ROSTER_ROLL_COLUMNS = ("roll_number", "roll number", "roll no", "roll", "roll_no")
+
+def parse_roster_csv(data):
+    """
+    Parses a class roster CSV into (name, roll_number) tuples.
+    Uses the header row when it names the columns, otherwise takes the first two columns as name and roll number.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8-sig")
+    rows = [row for row in csv.reader(io.StringIO(data)) if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+
+    header = [cell.strip().lower() for cell in rows[0]]
+    name_idx = next((header.index(c) for c in ROSTER_NAME_COLUMNS if c in header), None)
+    roll_idx = next((header.index(c) for c in ROSTER_ROLL_COLUMNS if c in header), None)
+    if name_idx is not None and roll_idx is not None:
+        rows = rows[1:]
+    else:
+        name_idx, roll_idx = 0, 1
+
+    students = []
+    for row in rows:
+        if len(row) <= max(name_idx, roll_idx):
+            continue
+        name, roll = row[name_idx].strip(), row[roll_idx].strip()
+        if name:
+            students.append((name, roll))
+    return students
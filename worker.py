@@ -0,0 +1,117 @@
+"""
+Standalone grading worker.
+
+Takes jobs from the `grading_jobs` queue in the SQLite database, grades them with AIGrader and
+saves the results through DatabaseManager. The Streamlit app only enqueues jobs and polls their
+status, so grading keeps going when a teacher closes the tab, and throughput scales with the
+number of worker processes:
+
+    python -m worker --workers 8 --rpm 60
+
+Run it from the app's working directory so the queued answer sheet paths resolve. The Gemini API
+key is read from --api-key or the GEMINI_API_KEY environment variable (a .env file works too).
+"""
+import argparse
+import os
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+from database import DatabaseManager
+from context_cache import ExamContextCache
+from grade_cache import GradeCache
+from grading_engine import BatchGrader
+from metrics import get_metrics
+from blob_store import BlobStore
+from sheet_derivatives import SheetDerivatives
+
+
+def log_progress(done, total, task, res):
+    outcome = task["status"]
+    if "error" in res:
+        outcome += f" ({res['error']})"
+    print(f"[worker] job {task['job_id']} · {task['student_name']}: {outcome}", flush=True)
+
+
+def export_metrics(directory, batch_id):
+    metrics = get_metrics()
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"batch_{batch_id}")
+    with open(stem + ".json", "w") as f:
+        f.write(metrics.to_json(batch_id))
+    with open(stem + ".csv", "w", newline="") as f:
+        f.write(metrics.to_csv(batch_id))
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Grade queued answer sheets in the background.")
+    parser.add_argument("--db", default="school_grades.db", help="SQLite database shared with the app")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"))
+    parser.add_argument("--model", default=os.environ.get("GEMINI_MODEL"), help="Model for jobs queued without one (default: GEMINI_MODEL)")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel model calls in this process")
+    parser.add_argument("--rpm", type=int, default=60, help="Requests per minute for this process")
+    parser.add_argument("--pack-size", type=int, default=1, help="Sheets per model call (exam context sent once)")
+    parser.add_argument("--context-cache", action="store_true", help="Reference each exam's context through provider-side context caching")
+    parser.add_argument("--exam-id", type=int, default=None, help="Only grade jobs for this exam")
+    parser.add_argument("--poll", type=float, default=2.0, help="Seconds between queue polls when idle")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is drained")
+    parser.add_argument("--metrics-dir", default=None, help="Write each batch's timing metrics here as JSON and CSV")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("An API key is required (--api-key or GEMINI_API_KEY).")
+
+    # Imported here so --help works without the model SDK installed.
+    from ai_engine import get_grader
+
+    db = DatabaseManager(args.db)
+    cache = GradeCache()
+    context_cache = ExamContextCache() if args.context_cache else None
+    derivatives = SheetDerivatives(BlobStore())
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    def grader_for_model(model_name):
+        return get_grader(args.api_key, model_name, cache=cache, context_cache=context_cache, derivatives=derivatives)
+
+    unassigned = db.get_unassigned_grading_job_count()
+    if unassigned and not args.model:
+        print(f"[worker] skipping {unassigned} queued jobs without a model; pass --model to grade them", flush=True)
+
+    batch = BatchGrader(
+        grader_for_model(args.model) if args.model else None,
+        db,
+        max_workers=args.workers,
+        requests_per_minute=args.rpm,
+        poll_interval=args.poll,
+        pack_size=args.pack_size,
+        grader_for_model=grader_for_model,
+    )
+
+    print(f"[worker] polling {args.db} with {args.workers} parallel requests", flush=True)
+    try:
+        while not stop.is_set():
+            summary = batch.resume(args.exam_id, on_progress=log_progress, stop=stop)
+            if summary["graded"] or summary["failed"]:
+                print(f"[worker] batch finished: {summary['graded']} graded, {summary['failed']} failed", flush=True)
+                if args.metrics_dir:
+                    export_metrics(args.metrics_dir, summary["batch_id"])
+            if args.once:
+                break
+            if context_cache is not None:
+                # Don't keep paying for exam contexts while the queue is idle.
+                context_cache.release_idle(idle_seconds=300)
+            stop.wait(args.poll)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if context_cache is not None:
+            context_cache.release_all()
+        db.close()
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()